@@ -0,0 +1,48 @@
+"""Synthetic fixtures for the micro-benchmarks"""
+
+import datetime
+import math
+import random
+
+# one day, a month, a year and 20 years of daily counts
+ROW_DAYS = [1, 30, 365, 7300]
+
+# vertices per geometry
+VERTICES = [10, 1000, 100000, 1000000]
+
+
+def daily_rows(days, seed=0):
+    """aggregated query rows, one per day ending on 2020-12-31"""
+
+    rng = random.Random(seed)
+    end = datetime.date(2020, 12, 31)
+    rows = []
+
+    for offset in range(days - 1, -1, -1):
+        date = end - datetime.timedelta(days=offset)
+        rows.append({'year': date.year, 'day': date.timetuple().tm_yday, 'COUNT(*)': rng.randint(1, 500)})
+
+    return {'data': rows}
+
+
+def polygon_feature_collection(vertices, features=1, seed=0):
+    """FeatureCollection of irregular polygons around the Amazon with vertices spread across features"""
+
+    rng = random.Random(seed)
+    per_feature = max(4, vertices // features)
+    collection = {'type': 'FeatureCollection', 'features': []}
+
+    for index in range(features):
+        center_x, center_y = -60.0 + index, -10.0
+        ring = []
+
+        for step in range(per_feature - 1):
+            angle = 2 * math.pi * step / (per_feature - 1)
+            radius = 0.5 * (1 + 0.1 * rng.random())
+            ring.append([center_x + radius * math.cos(angle), center_y + radius * math.sin(angle)])
+        ring.append(ring[0])
+
+        collection['features'].append({'type': 'Feature', 'properties': {},
+                                       'geometry': {'type': 'Polygon', 'coordinates': [ring]}})
+
+    return collection
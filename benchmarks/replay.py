@@ -0,0 +1,354 @@
+"""Replay of gunicorn access logs
+
+Parses logs written with the access_log_format of gunicorn.py and sends their GET
+requests again, at the original pace scaled by --speed (0 sends them as fast as
+--concurrency allows), then reports latency percentiles per route and the cache hit
+rates of /admin/metrics. By default the requests are answered by the app in this
+process, whose upstream calls go to a local stand-in answering canned query and
+geostore responses after --upstream-latency seconds:
+
+    python -m benchmarks.replay access.log --speed 4
+    python -m benchmarks.replay access.log --anonymize --speed 0 --concurrency 20
+    python -m benchmarks.replay access.log --target http://127.0.0.1:62000 --admin-token <token>
+
+With --target the requests are sent to a running server, which only reports the
+metrics of the worker answering /admin/metrics. POST bodies aren't logged, so POST
+requests are skipped.
+"""
+
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from benchmarks import fixtures
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from Queue import Queue
+    from urllib import urlencode
+    from urlparse import parse_qsl, urlsplit
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from queue import Queue
+    from urllib.parse import parse_qsl, urlencode, urlsplit
+
+# '%(h)s %(l)s %(u)s %(t)s "%(r)s" %(s)s %(b)s "%(f)s" "%(a)s"'
+LOG_LINE = re.compile(r'(?P<host>\S+) \S+ \S+ \[(?P<time>[^\]]+)\] "(?P<request>[^"]*)" (?P<status>\d{3}) \S+ '
+                      r'"[^"]*" "[^"]*"')
+
+# query parameters identifying users or the areas they drew
+ANONYMIZED_PARAMS = ['geostore']
+DROPPED_PARAMS = ['loggedUser']
+
+
+def _parse_time(value):
+    """seconds since the epoch of a [10/Oct/2020:13:55:36 -0700] log time"""
+
+    date, offset = value.split(' ')
+    timestamp = datetime.datetime.strptime(date, '%d/%b/%Y:%H:%M:%S')
+    minutes = int(offset[1:3]) * 60 + int(offset[3:5])
+    timestamp -= datetime.timedelta(minutes=minutes if offset[0] == '+' else -minutes)
+
+    return (timestamp - datetime.datetime(1970, 1, 1)).total_seconds()
+
+
+def parse(lines):
+    """(seconds since the first request, path with query string) of the GET requests of the logs"""
+
+    requests, skipped = [], 0
+    for line in lines:
+        match = LOG_LINE.match(line)
+        if not match:
+            skipped += 1
+            continue
+
+        parts = match.group('request').split(' ')
+        if len(parts) != 3 or parts[0] != 'GET' or parts[1].startswith('/api/v2/ms/admin/'):
+            skipped += 1
+            continue
+
+        requests.append((_parse_time(match.group('time')), parts[1]))
+
+    requests.sort(key=lambda request: request[0])
+    start = requests[0][0] if requests else 0
+
+    return [(timestamp - start, path) for timestamp, path in requests], skipped
+
+
+def anonymize(path, salt=''):
+    """path with identifying parameters replaced by a stable hash, so repeated areas still repeat"""
+
+    url = urlsplit(path)
+    params = []
+    for key, value in parse_qsl(url.query, keep_blank_values=True):
+        if key in DROPPED_PARAMS:
+            continue
+        if key in ANONYMIZED_PARAMS:
+            value = hashlib.md5((salt + value).encode('utf-8')).hexdigest()
+        params.append((key, value))
+
+    return url.path + ('?' + urlencode(params) if params else '')
+
+
+class _UpstreamHandler(BaseHTTPRequestHandler):
+    """canned answers of the query and geostore services"""
+
+    latency = 0.0
+
+    def _answer(self):
+        time.sleep(self.latency)
+        url = urlsplit(self.path)
+
+        if '/query/' in url.path:
+            sql = dict(parse_qsl(url.query)).get('sql', '')
+            group = re.search(r'GROUP BY (\w+)', sql, re.IGNORECASE)
+            if group and group.group(1).lower() == 'year':
+                content = fixtures.daily_rows(365)
+            elif group:
+                content = {'data': [{group.group(1): unit % 10, 'year': row['year'], 'day': row['day'],
+                                     'COUNT(day)': row['COUNT(*)']}
+                                    for unit, row in enumerate(fixtures.daily_rows(30)['data'])]}
+            else:
+                content = {'data': [{'MAX(year)': 2020, 'MAX(day)': 366, 'MIN(year)': 2004, 'MIN(day)': 1,
+                                     'COUNT(day)': 1234}]}
+        elif '/geostore' in url.path:
+            geojson = fixtures.polygon_feature_collection(100)
+            content = {'data': {'id': hashlib.md5(url.path.encode('utf-8')).hexdigest(), 'type': 'geoStore',
+                                'attributes': {'areaHa': 1000.0, 'geojson': geojson}}}
+        else:
+            self.send_error(404)
+            return
+
+        body = json.dumps(content).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = _answer
+    do_POST = _answer
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def start_upstream(latency):
+    """serve the upstream stand-in from a background thread, returns its url"""
+
+    _UpstreamHandler.latency = latency
+    server = _ThreadingServer(('127.0.0.1', 0), _UpstreamHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    return 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+
+class _LocalClient(object):
+    """sends requests to the app of this process"""
+
+    def __init__(self, admin_token):
+        from gladanalysis import create_application
+        from gladanalysis.config import settings
+
+        settings['admin']['token'] = admin_token
+        self.app = create_application()
+        self.client = self.app.test_client()
+        self.admin_token = admin_token
+
+    def get(self, path, headers=None):
+        response = self.client.get(path, headers=headers)
+        return response.status_code, response.get_data()
+
+
+class _RemoteClient(object):
+    """sends requests to a running server"""
+
+    def __init__(self, target, admin_token):
+        import requests
+        from gladanalysis import create_application
+
+        # the app is only built to look up the route of every request in its url map
+        self.app = create_application()
+        self.session = requests.Session()
+        self.target = target.rstrip('/')
+        self.admin_token = admin_token
+
+    def get(self, path, headers=None):
+        response = self.session.get(self.target + path, headers=headers)
+        return response.status_code, response.content
+
+
+def route_of(app, path):
+    """url rule answering a path, so /terrai-alerts/wdpa/1 and /terrai-alerts/wdpa/2 are reported together"""
+
+    try:
+        rule, _ = app.url_map.bind('localhost').match(urlsplit(path).path, return_rule=True)
+        return rule.rule
+    except Exception:
+        return 'unmatched'
+
+
+def replay(client, requests, speed, concurrency):
+    """send the requests, returns [(route, status, seconds)]"""
+
+    work = Queue(maxsize=concurrency * 2)
+    results = []
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            path = work.get()
+            if path is None:
+                return
+
+            start = time.time()
+            try:
+                status, _ = client.get(path)
+            except Exception:
+                status = None
+            duration = time.time() - start
+
+            with lock:
+                results.append((route_of(client.app, path), status, duration))
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    started = time.time()
+    for offset, path in requests:
+        if speed > 0:
+            delay = started + offset / speed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        work.put(path)
+
+    for _ in threads:
+        work.put(None)
+    for thread in threads:
+        thread.join()
+
+    return results
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100.0))]
+
+
+def summarize(results):
+    """latency percentiles and error count per route"""
+
+    routes = OrderedDict()
+    for route, status, duration in sorted(results, key=lambda result: result[0]):
+        routes.setdefault(route, []).append((status, duration))
+
+    summary = OrderedDict()
+    for route, calls in routes.items():
+        durations = [duration for _, duration in calls]
+        errors = sum(1 for status, _ in calls if status is None or status >= 500)
+        summary[route] = {'requests': len(calls), 'errors': errors,
+                          'p50': percentile(durations, 50), 'p90': percentile(durations, 90),
+                          'p99': percentile(durations, 99), 'max': max(durations)}
+
+    return summary
+
+
+def cache_hit_rates(client):
+    """hit rate per cache namespace from /admin/metrics"""
+
+    status, body = client.get('/api/v2/ms/admin/metrics', headers={'x-admin-token': client.admin_token})
+    if status != 200:
+        return {}
+
+    counters = json.loads(body.decode('utf-8'))['data']['counters']
+    # a namespace that never hit (or never missed) only has one of its counters
+    namespaces = set(name[len('cache.'):].rsplit('.', 1)[0] for name in counters
+                     if name.startswith('cache.') and name.endswith(('.hits', '.misses')))
+
+    rates = OrderedDict()
+    for namespace in sorted(namespaces):
+        hits = counters.get('cache.{}.hits'.format(namespace), 0)
+        misses = counters.get('cache.{}.misses'.format(namespace), 0)
+        rate = float(hits) / (hits + misses) if hits + misses else 0.0
+        rates[namespace] = {'hits': hits, 'misses': misses, 'rate': rate}
+
+    return rates
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay gunicorn access logs')
+    parser.add_argument('logs', nargs='+', help='access log files')
+    parser.add_argument('--speed', type=float, default=1.0, help='pace multiplier, 0 sends requests at once')
+    parser.add_argument('--concurrency', type=int, default=10, help='requests in flight at most')
+    parser.add_argument('--anonymize', action='store_true', help='replace geostore ids and drop user parameters')
+    parser.add_argument('--salt', default='', help='salt of the anonymized ids')
+    parser.add_argument('--limit', type=int, help='only replay the first requests')
+    parser.add_argument('--target', help='url of a running server, the app of this process by default')
+    parser.add_argument('--upstream-latency', type=float, default=0.05, help='seconds of every stand-in answer')
+    parser.add_argument('--admin-token', default=os.getenv('ADMIN_TOKEN') or 'replay')
+    parser.add_argument('--output', help='write the report as json to this file')
+    args = parser.parse_args()
+
+    lines = []
+    for log in args.logs:
+        with open(log) as log_file:
+            lines.extend(log_file)
+
+    requests, skipped = parse(lines)
+    if args.limit:
+        requests = requests[:args.limit]
+    if args.anonymize:
+        requests = [(offset, anonymize(path, args.salt)) for offset, path in requests]
+    print('{} requests to replay, {} lines skipped'.format(len(requests), skipped))
+
+    if args.target:
+        client = _RemoteClient(args.target, args.admin_token)
+    else:
+        # settings are read on import, the environment must point to the stand-in first
+        os.environ['CT_URL'] = start_upstream(args.upstream_latency)
+        for name, value in [('API_VERSION', 'v1'), ('CT_TOKEN', 'replay'), ('CT_REGISTER_MODE', 'False'),
+                            ('TERRAI_DATASET_ID', 'replay'), ('TERRAI_INDEX_ID', 'index_replay')]:
+            os.environ.setdefault(name, value)
+        client = _LocalClient(args.admin_token)
+
+    started = time.time()
+    summary = summarize(replay(client, requests, args.speed, args.concurrency))
+    elapsed = time.time() - started
+    caches = cache_hit_rates(client)
+
+    print('replayed in {:.1f}s'.format(elapsed))
+    print('{:<55} {:>8} {:>7} {:>9} {:>9} {:>9} {:>9}'.format('route', 'requests', 'errors', 'p50', 'p90', 'p99',
+                                                              'max'))
+    for route, stats in summary.items():
+        print('{:<55} {:>8} {:>7} {:>8.3f}s {:>8.3f}s {:>8.3f}s {:>8.3f}s'.format(
+            route, stats['requests'], stats['errors'], stats['p50'], stats['p90'], stats['p99'], stats['max']))
+
+    for namespace, rate in caches.items():
+        print('cache {:<20} {:>6.1%} of {} lookups'.format(namespace, rate['rate'], rate['hits'] + rate['misses']))
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump({'elapsed': elapsed, 'routes': summary, 'caches': caches}, output_file, indent=2)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
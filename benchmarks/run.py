@@ -0,0 +1,221 @@
+"""Micro-benchmarks of the service layer
+
+Every benchmark runs in its own interpreter so its peak memory isn't hidden by the ones
+run before it. Large geometries are computed by the geometry pool, whose workers' peak
+memory is reported separately (linux only, n/a elsewhere). Results can be saved as a local baseline and later runs compared to it:
+
+    python -m benchmarks.run --save             # record benchmarks/baseline.json
+    python -m benchmarks.run                    # compare, exits 1 on regressions
+    python -m benchmarks.run --quick -k area    # skip the largest fixtures, only area benchmarks
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import time
+from collections import OrderedDict
+
+from benchmarks import fixtures
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# fixtures skipped by --quick
+LARGE_ROW_DAYS = 7300
+LARGE_VERTICES = 1000000
+
+
+def _format_terrai_sql():
+    from gladanalysis.services import QueryConstructorService
+
+    return lambda: QueryConstructorService.format_terrai_sql(2004, 1, 2020, 366, 'BRA', 1, 2, agg_values=True)
+
+
+def _date_to_julian_day():
+    from gladanalysis.services import DateService
+
+    return lambda: DateService.date_to_julian_day('2004-01-01,2020-12-31')
+
+
+def _julian_day_to_date():
+    from gladanalysis.services import DateService
+
+    return lambda: DateService.julian_day_to_date(2020, 366)
+
+
+def _create_time_table(days, agg_type):
+    def setup():
+        from gladanalysis.services import SummaryService
+
+        data = fixtures.daily_rows(days)
+        return lambda: SummaryService.create_time_table('terrai', data, agg_type)
+
+    return setup
+
+
+def _tabulate_area(vertices):
+    def setup():
+        from gladanalysis.services import AreaService
+
+        geojson = fixtures.polygon_feature_collection(vertices)
+        return lambda: AreaService.tabulate_area(geojson)
+
+    return setup
+
+
+def benchmarks():
+    """name -> (setup returning the function to time, calls per sample, large fixture)"""
+
+    registry = OrderedDict()
+    registry['query.format_terrai_sql'] = (_format_terrai_sql, 1000, False)
+    registry['date.date_to_julian_day'] = (_date_to_julian_day, 1000, False)
+    registry['date.julian_day_to_date'] = (_julian_day_to_date, 1000, False)
+
+    for days in fixtures.ROW_DAYS:
+        for agg_type in ('day', 'month'):
+            registry['summary.create_time_table[{}d,{}]'.format(days, agg_type)] = \
+                (_create_time_table(days, agg_type), 1, days >= LARGE_ROW_DAYS)
+
+    for vertices in fixtures.VERTICES:
+        registry['area.tabulate_area[{}v]'.format(vertices)] = \
+            (_tabulate_area(vertices), 1, vertices >= LARGE_VERTICES)
+
+    return registry
+
+
+def _peak_rss_kb():
+    # kilobytes on linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def _children_peak_rss_kb():
+    """summed peak rss of the live child processes (geometry pool workers), None without /proc"""
+
+    total = 0
+    for child in multiprocessing.active_children():
+        try:
+            with open('/proc/{}/status'.format(child.pid)) as status:
+                total += sum(int(line.split()[1]) for line in status if line.startswith('VmHWM:'))
+        except IOError:
+            return None
+
+    return total
+
+
+def measure(name, samples):
+    """time one benchmark in the current process"""
+
+    setup, number, _ = benchmarks()[name]
+    func = setup()
+    rss_before = _peak_rss_kb()
+
+    # warm up (lazy imports, geometry pool workers whose memory isn't counted)
+    func()
+
+    timings = []
+    for _ in range(samples):
+        start = time.time()
+        for _ in range(number):
+            func()
+        timings.append((time.time() - start) / number)
+
+    timings.sort()
+    rss_after = _peak_rss_kb()
+
+    # work shipped to the geometry pool uses the memory of its workers, not of this process
+    return {'name': name, 'best': timings[0], 'median': timings[len(timings) // 2], 'samples': samples,
+            'peak_rss_kb': rss_after, 'rss_growth_kb': rss_after - rss_before,
+            'children_peak_rss_kb': _children_peak_rss_kb()}
+
+
+def run(name, samples):
+    """measure a benchmark in a fresh interpreter"""
+
+    env = dict(os.environ)
+    env.setdefault('TERRAI_INDEX_ID', 'index_benchmark')
+    output = subprocess.check_output([sys.executable, '-m', 'benchmarks.run', '--measure', name,
+                                      '--samples', str(samples)], env=env)
+
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def compare(result, baseline, threshold):
+    """regression messages of a result against its baseline"""
+
+    regressions = []
+    if baseline is None:
+        return regressions
+
+    # the best sample is the least sensitive to noise from the rest of the machine
+    if result['best'] > baseline['best'] * (1 + threshold):
+        regressions.append('time {:.6f}s -> {:.6f}s'.format(baseline['best'], result['best']))
+
+    # memory is noisier at small sizes, ignore growth below 1MB
+    if result['rss_growth_kb'] > baseline['rss_growth_kb'] * (1 + threshold) + 1024:
+        regressions.append('memory +{}KB -> +{}KB'.format(baseline['rss_growth_kb'], result['rss_growth_kb']))
+
+    children, baseline_children = result.get('children_peak_rss_kb'), baseline.get('children_peak_rss_kb')
+    if children and baseline_children and children > baseline_children * (1 + threshold) + 1024:
+        regressions.append('pool memory {}KB -> {}KB'.format(baseline_children, children))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Service layer micro-benchmarks')
+    parser.add_argument('-k', dest='keyword', help='only run benchmarks whose name contains this')
+    parser.add_argument('--quick', action='store_true', help='skip the largest fixtures')
+    parser.add_argument('--samples', type=int, default=5)
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save', action='store_true', help='store the results as baseline')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown, 0.2 is 20%%')
+    parser.add_argument('--measure', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(args.measure, args.samples)))
+        return 0
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    results = OrderedDict()
+    failed = []
+
+    for name, (_, _, large) in benchmarks().items():
+        if (args.keyword and args.keyword not in name) or (args.quick and large):
+            continue
+
+        result = run(name, args.samples)
+        results[name] = result
+        regressions = compare(result, baseline.get(name), args.threshold)
+
+        children = result.get('children_peak_rss_kb')
+        print('{:<45} {:>12.6f}s {:>10}KB {:>14} {}'.format(
+            name, result['best'], result['rss_growth_kb'],
+            'pool n/a' if children is None else 'pool {}KB'.format(children) if children else '',
+            'REGRESSION ' + ', '.join(regressions) if regressions else ''))
+        if regressions:
+            failed.append(name)
+
+    if args.save:
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as baseline_file:
+                baseline = json.load(baseline_file)
+        baseline.update(results)
+
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+        print('baseline saved to {}'.format(args.baseline))
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
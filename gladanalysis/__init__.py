@@ -5,7 +5,11 @@ import RWAPIMicroservicePython
 from flask import Flask
 
 from gladanalysis.config import settings
+from gladanalysis.decorators import apply_cache_control
 from gladanalysis.routes.api.v2 import endpoints
+from gladanalysis.services import GadmAreaService
+from gladanalysis.utils import admission, circuit_breaker, deadline, memory, profiling, slow_requests
+from gladanalysis.utils.compression import compress_response
 from gladanalysis.utils.files import load_config_json
 
 # Logging
@@ -23,9 +27,43 @@ def create_application():
     # Config
     application.config.from_object(settings)
 
+    # Precomputed gadm36 areas
+    if settings.get('gadm', {}).get('area_table'):
+        GadmAreaService.load(settings['gadm']['area_table'])
+
     # Routing
     application.register_blueprint(endpoints, url_prefix='/api/v2/ms')
 
+    # Compress large responses once every other hook has run (after_request hooks run in reverse order)
+    application.after_request(compress_response)
+
+    # Opt-in profiling of single requests
+    application.before_request(profiling.start_profile)
+    application.after_request(profiling.stop_profile)
+    application.teardown_request(profiling.discard_profile)
+
+    # Trace of queries and upstream calls, kept for slow requests
+    application.before_request(slow_requests.start_request)
+    application.after_request(slow_requests.finish_request)
+
+    # Opt-in memory used per route
+    application.before_request(memory.start_request)
+    application.after_request(memory.finish_request)
+
+    # Deadline budget shared by every upstream call of a request
+    application.before_request(deadline.start_request)
+
+    # Concurrency limits per route class, waiting in the queue counts against the deadline
+    application.before_request(admission.admit)
+    application.teardown_request(admission.release)
+
+    # Responses built from last known good results while an upstream is unavailable
+    application.before_request(circuit_breaker.start_request)
+    application.after_request(circuit_breaker.stale_response)
+
+    # Route specific Cache-Control, registered before CT so it overrides the default private header
+    application.after_request(apply_cache_control)
+
     # CT
     info = load_config_json('register')
     swagger = load_config_json('swagger')
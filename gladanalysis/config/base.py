@@ -1,3 +1,5 @@
+import os
+
 settings = {
     'logging': {
         'level': 'DEBUG'
@@ -6,5 +8,161 @@ settings = {
         'name': 'forest-change-analysis-elastic',
         'uri': 'http://172.30.2.76:62000',
         'port': 62000
+    },
+    'datasets': {
+        # alert datasets that can be analyzed, a dataset without id isn't available
+        'terrai': {
+            'dataset_id': os.getenv('TERRAI_DATASET_ID'),
+            'index_id': os.getenv('TERRAI_INDEX_ID'),
+            'day_column': 'day',
+            'confidence': '',
+            'min_year': 2004
+        },
+        'glad': {
+            'dataset_id': os.getenv('GLAD_DATASET_ID'),
+            'index_id': os.getenv('GLAD_INDEX_ID'),
+            'day_column': 'julian_day',
+            'confidence': " AND (confidence = '3')" if os.getenv('GLAD_CONFIRMED_ONLY') == 'True' else '',
+            'min_year': 2015
+        }
+    },
+    'geometry': {
+        # number of worker processes used for heavy geometry work (0 runs everything inline)
+        'pool_size': int(os.getenv('GEOMETRY_POOL_SIZE', 2)),
+        # geometries with at least this many vertices are sent to the process pool
+        'offload_vertices': int(os.getenv('GEOMETRY_OFFLOAD_VERTICES', 20000)),
+        'timeout': float(os.getenv('GEOMETRY_TIMEOUT', 30))
+    },
+    'fanout': {
+        # concurrent analyses of the features of a FeatureCollection (breakdown=features)
+        'max_workers': int(os.getenv('FEATURE_FANOUT_WORKERS', 4)),
+        'max_features': int(os.getenv('FEATURE_BREAKDOWN_MAX', 50))
+    },
+    'geostore_registration': {
+        # POSTed geometries are registered with the geostore once and queried by id
+        'enabled': os.getenv('GEOSTORE_REGISTRATION') == 'True'
+    },
+    'tiles': {
+        # pyramid of daily counts per tile for mode=approximate, built with python -m gladanalysis.services.tile_service
+        'path': os.getenv('TILE_PYRAMID_PATH')
+    },
+    'gadm': {
+        # table built with python -m gladanalysis.services.gadm_area_service
+        'area_table': os.getenv('GADM_AREA_TABLE')
+    },
+    'hedging': {
+        'enabled': os.getenv('UPSTREAM_HEDGING') == 'True',
+        # a duplicate is sent once a call exceeds this percentile of recent latencies
+        'percentile': float(os.getenv('UPSTREAM_HEDGING_PERCENTILE', 95)),
+        'min_delay': float(os.getenv('UPSTREAM_HEDGING_MIN_DELAY', 0.05)),
+        # maximum share of recent calls that may be hedged
+        'max_rate': float(os.getenv('UPSTREAM_HEDGING_MAX_RATE', 0.1)),
+        'window': 200,
+        'min_samples': 20
+    },
+    'deadline': {
+        # seconds, kept below the gunicorn timeout so the worker answers with a 504 instead of being killed
+        'default': float(os.getenv('REQUEST_DEADLINE', 50)),
+        'max': float(os.getenv('REQUEST_DEADLINE_MAX', 55)),
+        'routes': {
+            'endpoints.terrai_date_range': 10,
+            'endpoints.terrai_latest': 10
+        }
+    },
+    'admission': {
+        # per worker concurrency limits of each route class, requests over the limit wait in a bounded queue
+        'enabled': os.getenv('ADMISSION_CONTROL', 'True') == 'True',
+        'queue_timeout': float(os.getenv('ADMISSION_QUEUE_TIMEOUT', 2)),
+        'retry_after': int(os.getenv('ADMISSION_RETRY_AFTER', 1)),
+        'classes': {
+            'cheap': {'limit': int(os.getenv('ADMISSION_CHEAP_LIMIT', 200)),
+                      'queue': int(os.getenv('ADMISSION_CHEAP_QUEUE', 200))},
+            'analysis': {'limit': int(os.getenv('ADMISSION_ANALYSIS_LIMIT', 50)),
+                         'queue': int(os.getenv('ADMISSION_ANALYSIS_QUEUE', 100))},
+            # POSTed geojson
+            'geometry': {'limit': int(os.getenv('ADMISSION_GEOMETRY_LIMIT', 8)),
+                         'queue': int(os.getenv('ADMISSION_GEOMETRY_QUEUE', 16))}
+        },
+        'default': 'analysis',
+        'routes': {
+            'endpoints.terrai_date_range': 'cheap',
+            'endpoints.terrai_latest': 'cheap',
+            'endpoints.terrai_job': 'cheap'
+        }
+    },
+    'jobs': {
+        # background analyses (async=true) per worker, jobs over the queue size are rejected with a 503
+        'workers': int(os.getenv('JOB_WORKERS', 2)),
+        'queue_size': int(os.getenv('JOB_QUEUE_SIZE', 20)),
+        # seconds, jobs aren't bound by the request deadline or the gunicorn timeout
+        'timeout': float(os.getenv('JOB_TIMEOUT', 600))
+    },
+    'circuit_breaker': {
+        'enabled': os.getenv('CIRCUIT_BREAKER', 'True') == 'True',
+        # outcomes of the last calls to each upstream, the circuit opens once enough of them failed or were slow
+        'window': int(os.getenv('CIRCUIT_BREAKER_WINDOW', 50)),
+        'min_calls': int(os.getenv('CIRCUIT_BREAKER_MIN_CALLS', 20)),
+        'error_rate': float(os.getenv('CIRCUIT_BREAKER_ERROR_RATE', 0.5)),
+        'slow_call': float(os.getenv('CIRCUIT_BREAKER_SLOW_CALL', 10)),
+        'slow_rate': float(os.getenv('CIRCUIT_BREAKER_SLOW_RATE', 0.5)),
+        # seconds before a probe call is let through
+        'open_seconds': float(os.getenv('CIRCUIT_BREAKER_OPEN_SECONDS', 30))
+    },
+    'http_cache': {
+        # responses only change when alerts are ingested, so validators derive from the latest alert date
+        'cache_control': os.getenv('CACHE_CONTROL', 'public, max-age=300'),
+        'routes': {
+            'endpoints.terrai_date_range': 'public, max-age=3600',
+            'endpoints.terrai_latest': 'public, max-age=3600'
+        }
+    },
+    'cache': {
+        # memory (per worker) or redis (shared by every worker and pod)
+        'backend': os.getenv('CACHE_BACKEND', 'memory'),
+        'redis_url': os.getenv('REDIS_URL', 'redis://localhost:6379/0'),
+        'prefix': 'terrai-analysis:',
+        'max_entries': int(os.getenv('CACHE_MAX_ENTRIES', 4096)),
+        # bytes of the memory backend (as compact json), bigger values are left to the upstreams
+        'max_bytes': int(os.getenv('CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+        'max_entry_bytes': int(os.getenv('CACHE_MAX_ENTRY_BYTES', 1024 * 1024)),
+        # seconds; dates and analyses only change when alerts are ingested, geostores never do
+        'date_ttl': int(os.getenv('LATEST_DATE_TTL', 300)),
+        'analysis_ttl': int(os.getenv('ANALYSIS_CACHE_TTL', 300)),
+        'geostore_ttl': int(os.getenv('GEOSTORE_CACHE_TTL', 86400)),
+        # last known good results served while an upstream circuit is open
+        'stale_ttl': int(os.getenv('STALE_CACHE_TTL', 604800)),
+        'job_ttl': int(os.getenv('JOB_TTL', 3600)),
+        'geostore_id_ttl': int(os.getenv('GEOSTORE_ID_TTL', 2592000)),
+        # cumulative series are extended as alerts are ingested, the ttl bounds how long backfilled days are missed
+        'series_ttl': int(os.getenv('SERIES_CACHE_TTL', 86400))
+    },
+    'series_cache': {
+        'enabled': os.getenv('SERIES_CACHE') == 'True'
+    },
+    'compression': {
+        'enabled': os.getenv('COMPRESSION', 'True') == 'True',
+        # smaller bodies are sent as is
+        'min_size': int(os.getenv('COMPRESSION_MIN_SIZE', 1024)),
+        'gzip_level': int(os.getenv('COMPRESSION_GZIP_LEVEL', 6)),
+        'brotli_quality': int(os.getenv('COMPRESSION_BROTLI_QUALITY', 4))
+    },
+    'profiling': {
+        # share of requests profiled without being asked to
+        'sample_rate': float(os.getenv('PROFILE_SAMPLE_RATE', 0)),
+        'buffer_size': int(os.getenv('PROFILE_BUFFER_SIZE', 20))
+    },
+    'slow_requests': {
+        # seconds, slower requests are kept with their queries and upstream call durations
+        'threshold': float(os.getenv('SLOW_REQUEST_THRESHOLD', 5)),
+        'buffer_size': int(os.getenv('SLOW_REQUEST_BUFFER_SIZE', 50))
+    },
+    'memory': {
+        # rss per route and allocation growth of every worker, listed by /admin/memory
+        'enabled': os.getenv('MEMORY_TRACKING') == 'True',
+        # frames kept per traced allocation when tracemalloc is available
+        'frames': int(os.getenv('MEMORY_TRACE_FRAMES', 1))
+    },
+    'admin': {
+        'token': os.getenv('ADMIN_TOKEN')
     }
 }
@@ -0,0 +1,104 @@
+"""DECORATORS"""
+
+import datetime
+import hashlib
+import os
+from functools import wraps
+
+from flask import g, jsonify, make_response, request
+
+from gladanalysis.config import settings
+from gladanalysis.services import DateService, ResponseService
+from gladanalysis.utils import jobs
+
+
+def request_fingerprint():
+    """hash of everything a GET response depends on apart from the data itself"""
+
+    # loggedUser is added by control tower for authenticated calls and doesn't change the result
+    args = sorted((key, value) for key, value in request.args.items(multi=True) if key != 'loggedUser')
+    parts = [request.method, request.path, repr(args),
+             ResponseService.requested_format(request.args, request.headers.get('Accept'))]
+
+    # without a period the default one ends today
+    if 'period' not in request.args:
+        parts.append(datetime.date.today().isoformat())
+
+    return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
+
+
+def conditional(func):
+    """answer GET requests with ETag/Last-Modified derived from the latest alert date,
+    returning 304 without running the analysis when the client copy is current"""
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+
+        if request.method != 'GET':
+            return func(*args, **kwargs)
+
+        http_cache = settings.get('http_cache', {})
+        g.cache_control = http_cache.get('routes', {}).get(request.endpoint, http_cache.get('cache_control'))
+
+        latest_date = DateService.get_latest_date(os.getenv('TERRAI_DATASET_ID'), os.getenv('TERRAI_INDEX_ID'))
+        etag = hashlib.sha1('{}|{}'.format(request_fingerprint(), latest_date).encode('utf-8')).hexdigest()
+
+        last_modified = datetime.datetime(*[int(part) for part in latest_date.split('-')])
+        if 'period' not in request.args:
+            last_modified = max(last_modified, datetime.datetime.combine(datetime.date.today(), datetime.time()))
+
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains_weak(etag)
+        else:
+            not_modified = request.if_modified_since is not None and request.if_modified_since >= last_modified
+
+        if not_modified:
+            response = make_response('', 304)
+        else:
+            response = make_response(func(*args, **kwargs))
+
+        if response.status_code in (200, 304):
+            # weak, so compressed representations share the validator
+            response.set_etag(etag, weak=True)
+            response.last_modified = last_modified
+            response.vary.add('Accept')
+
+        return response
+
+    return wrapper
+
+
+# public url of a job, as routed by control tower (see microservice/register.json)
+JOB_URL = '/v1/terrai-alerts/jobs/{}'
+
+
+def asynchronous(func):
+    """queue requests sent with async=true as jobs, answering 202 with the job to poll"""
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+
+        if request.args.get('async', '').lower() != 'true':
+            return func(*args, **kwargs)
+
+        job_id = jobs.submit()
+
+        response = jsonify({'data': ResponseService.format_job(job_id, jobs.get(job_id))})
+        response.status_code = 202
+        response.headers['Location'] = JOB_URL.format(job_id)
+        # relative, the host of this service isn't the one clients call
+        response.autocorrect_location_header = False
+
+        return response
+
+    return wrapper
+
+
+def apply_cache_control(response):
+    """after_request hook setting the Cache-Control chosen by the route"""
+
+    cache_control = getattr(g, 'cache_control', None)
+    if cache_control and response.status_code in (200, 304):
+        response.headers['Cache-Control'] = cache_control
+
+    return response
@@ -1,6 +1,8 @@
 class Error(Exception):
 
     def __init__(self, message):
+        # args let errors raised in geometry pool processes be unpickled by the parent
+        super(Error, self).__init__(message)
         self.message = message
 
     @property
@@ -12,3 +14,19 @@ class Error(Exception):
 
 class GeostoreNotFound(Error):
     pass
+
+
+class GeometryTimeout(Error):
+    pass
+
+
+class DeadlineExceeded(Error):
+    pass
+
+
+class ServiceOverloaded(Error):
+    pass
+
+
+class UpstreamUnavailable(Error):
+    pass
@@ -4,6 +4,9 @@ from __future__ import print_function
 
 from flask import Blueprint, jsonify
 
+from gladanalysis.config import settings
+from gladanalysis.errors import DeadlineExceeded, ServiceOverloaded, UpstreamUnavailable
+
 
 # GENERIC Error
 
@@ -15,4 +18,26 @@ def error(status=400, detail='Bad Request'):
 
 
 endpoints = Blueprint('endpoints', __name__)
+
+
+@endpoints.errorhandler(DeadlineExceeded)
+def deadline_exceeded(e):
+    return error(status=504, detail=e.message)
+
+
+@endpoints.errorhandler(ServiceOverloaded)
+def service_overloaded(e):
+    response, status = error(status=503, detail=e.message)
+    response.headers['Retry-After'] = str(settings.get('admission', {}).get('retry_after', 1))
+    return response, status
+
+
+@endpoints.errorhandler(UpstreamUnavailable)
+def upstream_unavailable(e):
+    response, status = error(status=503, detail=e.message)
+    response.headers['Retry-After'] = str(int(settings.get('circuit_breaker', {}).get('open_seconds', 30)))
+    return response, status
+
+
 import gladanalysis.routes.api.v2.terrai_router
+import gladanalysis.routes.api.v2.admin_router
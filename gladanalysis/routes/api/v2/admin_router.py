@@ -0,0 +1,68 @@
+import logging
+
+from flask import jsonify, make_response, request
+
+from gladanalysis.routes.api.v2 import error
+from gladanalysis.utils import memory, metrics, profiling, slow_requests
+from gladanalysis.validators import validate_admin_token, validate_limit
+from . import endpoints
+
+"""ADMIN ENDPOINTS"""
+
+
+@endpoints.route('/admin/metrics', methods=['GET'])
+@validate_admin_token
+def admin_metrics():
+    """get the metrics of this worker process"""
+    logging.info('[ROUTER]: Getting worker metrics')
+
+    return jsonify({'data': metrics.snapshot()}), 200
+
+
+@endpoints.route('/admin/slow-requests', methods=['GET'])
+@validate_admin_token
+def admin_slow_requests():
+    """list the slow requests kept by this worker process, most recent first"""
+    logging.info('[ROUTER]: Listing slow requests')
+
+    return jsonify({'data': slow_requests.list_requests()}), 200
+
+
+@endpoints.route('/admin/memory', methods=['GET'])
+@validate_admin_token
+@validate_limit
+def admin_memory():
+    """get the memory of this worker process, per route and by allocation site"""
+    logging.info('[ROUTER]: Getting worker memory')
+
+    return jsonify({'data': memory.report(int(request.args.get('limit', 20)))}), 200
+
+
+@endpoints.route('/admin/profiles', methods=['GET'])
+@validate_admin_token
+def admin_profiles():
+    """list the profiles kept by this worker process"""
+    logging.info('[ROUTER]: Listing request profiles')
+
+    return jsonify({'data': profiling.list_profiles()}), 200
+
+
+@endpoints.route('/admin/profiles/<profile_id>', methods=['GET'])
+@validate_admin_token
+def admin_profile(profile_id):
+    """download a profile as pstats (default) or as a text report"""
+    logging.info('[ROUTER]: Getting request profile')
+
+    profile = profiling.get_profile(profile_id)
+    if not profile:
+        return error(status=404, detail='Profile not found')
+
+    if request.args.get('format') == 'text':
+        response = make_response(profiling.format_profile(profile))
+        response.mimetype = 'text/plain'
+    else:
+        response = make_response(profile['stats'])
+        response.mimetype = 'application/octet-stream'
+        response.headers['Content-Disposition'] = 'attachment; filename={}.pstats'.format(profile_id)
+
+    return response
@@ -4,12 +4,17 @@ import os
 
 from flask import jsonify, request
 
-from gladanalysis.errors import GeostoreNotFound
+from gladanalysis.config import settings
+from gladanalysis.decorators import asynchronous, conditional
+from gladanalysis.errors import GeostoreNotFound, GeometryTimeout, DeadlineExceeded
 from gladanalysis.routes.api.v2 import error
 from gladanalysis.services import GeostoreService, DateService, QueryConstructorService, AnalysisService, \
-    ResponseService, SummaryService, AreaService
+    ResponseService, SummaryService, AreaService, GadmAreaService, SeriesService, DatasetService, TileService
+from gladanalysis.utils import jobs
+from gladanalysis.utils.fanout import map_concurrently
 from gladanalysis.validators import validate_geostore, validate_terrai_period, validate_agg, validate_admin, \
-    validate_wdpa
+    validate_wdpa, validate_format, validate_since, validate_limit, validate_breakdown, \
+    validate_datasets, validate_mode, validate_async
 from . import endpoints
 
 datasetID = os.getenv('TERRAI_DATASET_ID')
@@ -17,6 +22,12 @@ indexID = os.getenv('TERRAI_INDEX_ID')
 
 
 def analyze(area=None, geostore=None, iso=None, state=None, dist=None, geojson=None):
+    """Analyze the area and return the API response, see analyze_area"""
+
+    return jsonify({'data': analyze_area(area, geostore, iso, state, dist, geojson)}), 200
+
+
+def analyze_area(area=None, geostore=None, iso=None, state=None, dist=None, geojson=None, dataset='terrai'):
     """Analyze method to execute queries
     This is designed to format the dates of the request, create the sql and download sql queries from
     the dates, retrieve the data from the queries and send the data to a formatter service to format
@@ -27,50 +38,215 @@ def analyze(area=None, geostore=None, iso=None, state=None, dist=None, geojson=N
     :param dist: the district ID based on gadm
     :param state: the state ID based on gadm
     :param geojson: the geojson inlcuded in the body (if post request)
-    :return: returns the response of the API request formatted by the format service"""
+    :param dataset: name of the dataset in the registry
+    :return: returns the data of the API response formatted by the format service"""
 
+    config = DatasetService.get(dataset)
+    dataset_id, index_id = config['dataset_id'], config['index_id']
     today = datetime.datetime.today().strftime('%Y-%m-%d')
 
     # get parameter from query string
     period = request.args.get('period', '2004-01-01,{}'.format(today))
     agg_values = request.args.get('aggregate_values', False)
     agg_by = request.args.get('aggregate_by', None)
+    window = int(request.args.get('window', 7)) if agg_by == 'rolling' else None
+    output_format = ResponseService.requested_format(request.args, request.headers.get('Accept'))
 
     # grab geojson if it exists
-    geojson = request.get_json().get('geojson', None) if request.get_json() else None
+    if geojson is None and geostore is None:
+        geojson = request.get_json().get('geojson', None) if request.get_json() else None
+
+    # incremental mode: only alerts newer than the last date seen by the client
+    since = request.args.get('since', None)
+    latest_date = DateService.get_latest_date(dataset_id, index_id, config['day_column']) if since else None
+
+    # rolling and year over year statistics need the days before the period
+    query_period = period
+    if agg_values and agg_by in SummaryService.STATISTICS and not since:
+        query_period = SummaryService.statistics_period(agg_by, period, window)
 
     # format period request to julian dates
-    from_year, from_date, to_year, to_date = DateService.date_to_julian_day(period, datasetID, indexID, "day")
+    if since:
+        from_year, from_date, to_year, to_date = DateService.date_to_julian_day('{},{}'.format(since, latest_date))
+        period = None
+    else:
+        from_year, from_date, to_year, to_date = DateService.date_to_julian_day(query_period, dataset_id, index_id,
+                                                                                config['day_column'])
 
     # grab query and download sql from sql service
-    sql, download_sql = QueryConstructorService.format_terrai_sql(from_year, from_date, to_year, to_date, iso, state,
-                                                                  dist, agg_values)
+    sql, download_sql = QueryConstructorService.format_alerts_sql(config, from_year, from_date, to_year, to_date, iso,
+                                                                  state, dist, agg_values, since=bool(since))
 
     kwargs = {'download_sql': download_sql,
               'area': area,
               'geostore': geostore,
               'agg': agg_values,
-              'period': period}
+              'period': period,
+              'since': since,
+              'latest_date': latest_date}
+
+    # nothing was ingested after the client's last poll, no need to query
+    up_to_date = since and since >= latest_date
+
+    # any period of the area is answered from its cached cumulative series (built from terrai queries)
+    series = None
+    if dataset == 'terrai' and not since and settings.get('series_cache', {}).get('enabled'):
+        series = SeriesService.get_series(dataset_id, index_id, geostore, geojson, iso, state, dist)
 
     if agg_values:
         if not agg_by or agg_by == 'julian_day':
             agg_by = 'day'
 
         kwargs['agg_by'] = agg_by
+        kwargs['columnar'] = output_format == 'columnar'
+        kwargs['delta_dates'] = request.args.get('delta_dates', '').lower() == 'true'
+
+        if up_to_date:
+            data = {'data': []}
+        elif series is not None:
+            data = {'data': SeriesService.rows(series, query_period)}
+        else:
+            data = AnalysisService.make_analysis_request(dataset_id, sql, geostore, geojson)
 
-        data = AnalysisService.make_analysis_request(datasetID, sql, geostore, geojson)
-        agg_data = SummaryService.create_time_table('terrai', data, agg_by)
-        standard_format = ResponseService.standardize_response('Terrai', agg_data, datasetID, **kwargs)
+        if agg_by in SummaryService.STATISTICS:
+            agg_data = SummaryService.create_statistics(dataset, data, agg_by, period, window)
+        else:
+            agg_data = SummaryService.create_time_table(dataset, data, agg_by)
+        standard_format = ResponseService.standardize_response(dataset, agg_data, dataset_id, **kwargs)
+
+        if agg_by == 'rolling':
+            standard_format['window'] = window
 
     else:
         kwargs['agg_by'] = None
         kwargs['count'] = "COUNT(julian_day)"
-        data = AnalysisService.make_analysis_request(datasetID, sql, geostore, geojson)
-        standard_format = ResponseService.standardize_response('Terrai', data, datasetID, **kwargs)
+        if up_to_date:
+            data = {'data': [{'count': 0}]}
+        elif series is not None:
+            data = {'data': [{'count': SeriesService.total(series, period)}]}
+        else:
+            data = AnalysisService.make_analysis_request(dataset_id, sql, geostore, geojson)
+        standard_format = ResponseService.standardize_response(dataset, data, dataset_id, **kwargs)
+
+    return standard_format
+
+
+def feature_breakdown(geojson):
+    """Analyze a FeatureCollection and each of its features, concurrently
+    :param geojson: the FeatureCollection included in the body
+    :return: returns the response for the whole collection with the area and value of every feature,
+    keyed by feature id (or position when features have no id)"""
+
+    collections = [{'type': 'FeatureCollection', 'features': [feature]} for feature in geojson['features']]
+
+    def analyze_collection(collection):
+        # the area of the whole collection is the sum of its features'
+        area = AreaService.tabulate_area(collection) if collection is not geojson else None
+        return analyze_area(area=area, geojson=collection)
+
+    results = map_concurrently(analyze_collection, [geojson] + collections,
+                               settings.get('fanout', {}).get('max_workers', 4))
+
+    standard_format = results[0]
+    standard_format['attributes']['areaHa'] = sum(result['attributes']['areaHa'] for result in results[1:])
+    standard_format['attributes']['features'] = {}
+
+    for index, (feature, result) in enumerate(zip(geojson['features'], results[1:])):
+        feature_id = feature.get('id', index)
+        standard_format['attributes']['features'][str(feature_id)] = {'areaHa': result['attributes']['areaHa'],
+                                                                      'value': result['attributes']['value']}
+
+    return jsonify({'data': standard_format}), 200
+
+
+def approximate(area=None, geostore=None, geojson=None):
+    """Estimate the number of alerts from the local tile pyramid instead of querying
+    :param area: the area of the request
+    :param geostore: the geostore id of the request
+    :param geojson: the geometry of the geostore or the geojson included in the body
+    :return: returns the estimate and its error bound, in the format of analyze"""
+
+    today = datetime.datetime.today().strftime('%Y-%m-%d')
+    period = request.args.get('period', '2004-01-01,{}'.format(today))
+
+    from_date, to_date = [datetime.datetime.strptime(date, '%Y-%m-%d').date() for date in period.split(',')]
+    count, error_bound = TileService.estimate(geojson, from_date, to_date)
+
+    # download urls still point to the exact alerts
+    from_year, from_day, to_year, to_day = DateService.date_to_julian_day(period, datasetID, indexID, "day")
+    download_sql = QueryConstructorService.format_terrai_sql(from_year, from_day, to_year, to_day)[1]
+
+    standard_format = ResponseService.standardize_response('terrai', {'data': [{'count': count}]}, datasetID,
+                                                           download_sql=download_sql, area=area, geostore=geostore,
+                                                           period=period)
+    standard_format['mode'] = 'approximate'
+    standard_format['attributes']['errorBound'] = error_bound
 
     return jsonify({'data': standard_format}), 200
 
 
+def combined(area=None, geostore=None, geojson=None):
+    """Analyze the same area in several datasets of the registry, concurrently
+    :param area: the area of the request, looked up once for every dataset
+    :param geostore: the geostore id of the request
+    :param geojson: the geojson included in the body (if post request)
+    :return: returns the response of every dataset listed in the datasets parameter (all by default)"""
+
+    datasets = request.args.get('datasets', None)
+    datasets = datasets.split(',') if datasets else DatasetService.available()
+
+    results = map_concurrently(lambda dataset: analyze_area(area, geostore, geojson=geojson, dataset=dataset),
+                               datasets, settings.get('fanout', {}).get('max_workers', 4))
+
+    return jsonify({'data': results}), 200
+
+
+def drilldown(group_column, level, iso=None, state=None, limit=None):
+    """Count alerts of every child unit of an admin area with a single grouped query
+    :param group_column: column holding the child unit id (country_iso, state_id or dist_id)
+    :param level: name of the child level returned in the response
+    :param iso: the country iso if specified
+    :param state: the state ID based on gadm
+    :param limit: only return the units with most alerts
+    :return: returns the counts (and time tables if aggregate_values) of every child unit"""
+
+    today = datetime.datetime.today().strftime('%Y-%m-%d')
+
+    # get parameter from query string
+    period = request.args.get('period', '2004-01-01,{}'.format(today))
+    agg_values = request.args.get('aggregate_values', '').lower() == 'true'
+    agg_by = request.args.get('aggregate_by', None)
+
+    if agg_values and (not agg_by or agg_by == 'julian_day'):
+        agg_by = 'day'
+
+    if agg_values and agg_by in SummaryService.STATISTICS:
+        return error(status=400, detail="{} statistics aren't available for drilldowns".format(agg_by))
+
+    from_year, from_date, to_year, to_date = DateService.date_to_julian_day(period, datasetID, indexID, "day")
+    sql = QueryConstructorService.format_terrai_drilldown_sql(from_year, from_date, to_year, to_date, group_column,
+                                                              iso, state, agg_values)[0]
+
+    data = AnalysisService.make_analysis_request(datasetID, sql, None, None)
+    groups = SummaryService.create_group_table('terrai', data, group_column, agg_by if agg_values else None)
+
+    if limit:
+        groups = groups[:limit]
+
+    # areas of child units only come from the bundled table, looking them up one by one would defeat the purpose
+    for group in groups:
+        child = {'country_iso': (group['id'], None, None), 'state_id': (iso, group['id'], None),
+                 'dist_id': (iso, state, group['id'])}[group_column]
+        area = GadmAreaService.lookup(*child)
+        if area is not None:
+            group['areaHa'] = area
+
+    response = ResponseService.format_drilldown('Terrai', groups, level, period, iso, state,
+                                                agg_by if agg_values else None)
+
+    return jsonify({'data': response}), 200
+
+
 """TERRA I ENDPOINTS"""
 
 
@@ -78,6 +254,13 @@ def analyze(area=None, geostore=None, iso=None, state=None, dist=None, geojson=N
 @validate_terrai_period
 @validate_geostore
 @validate_agg
+@validate_format
+@validate_since
+@validate_breakdown
+@validate_mode
+@validate_async
+@asynchronous
+@conditional
 def query_terrai():
     """analyze terrai by geostore or geojson"""
 
@@ -93,13 +276,39 @@ def query_terrai():
             logging.error('[ROUTER]: Geostore Not Found')
             return error(status=404, detail='Geostore not found')
 
+        if request.args.get('mode') == 'approximate':
+            return approximate(area=area, geostore=geostore, geojson=GeostoreService.get_geojson(geostore))
+
         return analyze(area=area, geostore=geostore)
 
     elif request.method == 'POST':
         logging.info('[ROUTER]: post geojson to terrai')
 
         geojson = request.get_json().get('geojson', None) if request.get_json() else None
-        area = AreaService.tabulate_area(geojson)
+
+        # query by geostore id rather than sending the geometry with every query
+        if settings.get('geostore_registration', {}).get('enabled') and not request.args.get('breakdown') and \
+                request.args.get('mode') != 'approximate':
+            try:
+                geostore, area = GeostoreService.register_geojson(geojson)
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                logging.warning('[ROUTER]: Geostore registration failed, sending the geometry: {}'.format(e))
+            else:
+                return analyze(area=area, geostore=geostore)
+
+        try:
+            if request.args.get('breakdown') == 'features':
+                return feature_breakdown(geojson)
+
+            area = AreaService.tabulate_area(geojson)
+        except GeometryTimeout:
+            logging.error('[ROUTER]: Geometry area computation timed out')
+            return error(status=504, detail='Geometry too complex to process')
+
+        if request.args.get('mode') == 'approximate':
+            return approximate(area=area, geojson=geojson)
 
         return analyze(area=area, geojson=geojson)
 
@@ -107,9 +316,62 @@ def query_terrai():
         return error(status=405, detail="Operation not supported")
 
 
+@endpoints.route('/terrai-alerts/jobs/<job_id>', methods=['GET'])
+def terrai_job(job_id):
+    """get the status of an analysis submitted with async=true, and its result once done"""
+    logging.info('[ROUTER]: Getting analysis job')
+
+    state = jobs.get(job_id)
+    if state is None:
+        return error(status=404, detail='Job not found')
+
+    return jsonify({'data': ResponseService.format_job(job_id, state)}), 200
+
+
+@endpoints.route('/terrai-alerts/combined', methods=['GET', 'POST'])
+@validate_terrai_period
+@validate_geostore
+@validate_agg
+@validate_format
+@validate_since
+@validate_datasets
+def query_combined():
+    """analyze several alert datasets by geostore or geojson"""
+
+    if request.method == 'GET':
+        logging.info('[ROUTER]: get combined alerts by Geostore')
+
+        geostore = request.args.get('geostore', None)
+
+        # a single geostore lookup shared by every dataset
+        try:
+            area = GeostoreService.make_area_request(geostore)
+        except GeostoreNotFound:
+            logging.error('[ROUTER]: Geostore Not Found')
+            return error(status=404, detail='Geostore not found')
+
+        return combined(area=area, geostore=geostore)
+
+    else:
+        logging.info('[ROUTER]: post geojson to combined alerts')
+
+        geojson = request.get_json().get('geojson', None) if request.get_json() else None
+        try:
+            area = AreaService.tabulate_area(geojson)
+        except GeometryTimeout:
+            logging.error('[ROUTER]: Geometry area computation timed out')
+            return error(status=504, detail='Geometry too complex to process')
+
+        return combined(area=area, geojson=geojson)
+
+
 @endpoints.route('/terrai-alerts/admin/<iso_code>', methods=['GET'])
 @validate_terrai_period
 @validate_admin
+@validate_agg
+@validate_format
+@validate_since
+@conditional
 def terrai_country(iso_code):
     """analyze terrai by gadm"""
     logging.info('Running Terra I country analysis')
@@ -123,6 +385,10 @@ def terrai_country(iso_code):
 @endpoints.route('/terrai-alerts/admin/<iso_code>/<admin_id>', methods=['GET'])
 @validate_terrai_period
 @validate_admin
+@validate_agg
+@validate_format
+@validate_since
+@conditional
 def terrai_admin(iso_code, admin_id):
     """analyze terrai by gadm"""
     logging.info('Running Terra I state analysis')
@@ -136,6 +402,10 @@ def terrai_admin(iso_code, admin_id):
 @endpoints.route('/terrai-alerts/admin/<iso_code>/<admin_id>/<dist_id>', methods=['GET'])
 @validate_terrai_period
 @validate_admin
+@validate_agg
+@validate_format
+@validate_since
+@conditional
 def terrai_dist(iso_code, admin_id, dist_id):
     """analyze terrai by gadm"""
     logging.info('Running Terra I Analysis on District')
@@ -146,8 +416,48 @@ def terrai_dist(iso_code, admin_id, dist_id):
     return analyze(area, iso=iso_code, state=admin_id, dist=dist_id)
 
 
+@endpoints.route('/terrai-alerts/drilldown/<iso_code>', methods=['GET'])
+@validate_terrai_period
+@validate_admin
+@validate_agg
+@conditional
+def terrai_country_drilldown(iso_code):
+    """count terrai alerts of every state of a country"""
+    logging.info('Running Terra I country drill-down')
+
+    return drilldown('state_id', 'adm1', iso=iso_code)
+
+
+@endpoints.route('/terrai-alerts/drilldown/<iso_code>/<admin_id>', methods=['GET'])
+@validate_terrai_period
+@validate_admin
+@validate_agg
+@conditional
+def terrai_admin_drilldown(iso_code, admin_id):
+    """count terrai alerts of every district of a state"""
+    logging.info('Running Terra I state drill-down')
+
+    return drilldown('dist_id', 'adm2', iso=iso_code, state=admin_id)
+
+
+@endpoints.route('/terrai-alerts/ranking', methods=['GET'])
+@validate_terrai_period
+@validate_agg
+@validate_limit
+@conditional
+def terrai_ranking():
+    """rank countries by number of terrai alerts"""
+    logging.info('Running Terra I country ranking')
+
+    return drilldown('country_iso', 'iso', limit=int(request.args.get('limit', 10)))
+
+
 @endpoints.route('/terrai-alerts/use/<use_type>/<use_id>', methods=['GET'])
 @validate_terrai_period
+@validate_agg
+@validate_format
+@validate_since
+@conditional
 def terrai_use(use_type, use_id):
     """analyze terrai by land use"""
     logging.info('Intersect Terra I and Land Use data')
@@ -161,6 +471,10 @@ def terrai_use(use_type, use_id):
 @endpoints.route('/terrai-alerts/wdpa/<wdpa_id>', methods=['GET'])
 @validate_terrai_period
 @validate_wdpa
+@validate_agg
+@validate_format
+@validate_since
+@conditional
 def terrai_wdpa(wdpa_id):
     """analyze terrai by wdpa geom"""
     logging.info('Intersect Terra I and WDPA')
@@ -172,6 +486,7 @@ def terrai_wdpa(wdpa_id):
 
 
 @endpoints.route('/terrai-alerts/date-range', methods=['GET'])
+@conditional
 def terrai_date_range():
     """get terrai date range"""
     logging.info('Creating Terra I Date Range')
@@ -187,13 +502,13 @@ def terrai_date_range():
 
 
 @endpoints.route('/terrai-alerts/latest', methods=['GET'])
+@conditional
 def terrai_latest():
     """get TerraI latest date"""
     logging.info('Getting latest date')
 
     # get max date
-    min_year, min_julian, max_year, max_julian = DateService.get_min_max_date('day', datasetID, indexID)
-    max_date = DateService.format_date_sql(min_year, min_julian, max_year, max_julian)[1]
+    max_date = DateService.get_latest_date(datasetID, indexID)
 
     # standardize latest date response
     response = ResponseService.format_latest_date("Terrai", max_date)
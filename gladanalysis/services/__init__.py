@@ -6,8 +6,12 @@ from __future__ import print_function
 
 from gladanalysis.services.analysis_service import AnalysisService
 from gladanalysis.services.area_service import AreaService
+from gladanalysis.services.dataset_service import DatasetService
 from gladanalysis.services.date_service import DateService
+from gladanalysis.services.gadm_area_service import GadmAreaService
 from gladanalysis.services.geostore_service import GeostoreService
 from gladanalysis.services.query_constructor_service import QueryConstructorService
 from gladanalysis.services.response_service import ResponseService
+from gladanalysis.services.series_service import SeriesService
 from gladanalysis.services.summary_service import SummaryService
+from gladanalysis.services.tile_service import TileService
@@ -1,6 +1,12 @@
-from RWAPIMicroservicePython import request_to_microservice
 from flask import request
 
+from gladanalysis.errors import UpstreamUnavailable
+from gladanalysis.utils import circuit_breaker, slow_requests
+from gladanalysis.utils.cache import Cache
+from gladanalysis.utils.upstream import request_upstream
+
+_analyses = Cache('analysis', 'analysis_ttl', keep_stale=True)
+
 
 class AnalysisService(object):
     """Class for sending queries to databases and capturing response
@@ -10,7 +16,10 @@ class AnalysisService(object):
     @staticmethod
     def make_analysis_request(dataset_id, sql, geostore, geojson, v2=False):
 
-        if request.method == 'GET':
+        slow_requests.record_sql(sql)
+
+        # geometries registered with the geostore are referenced by id whatever the request method
+        if request.method == 'GET' or (geostore and not geojson):
             uri = "/query/" + dataset_id + '?sql=' + sql + '&format=json'
 
             if geostore:
@@ -44,4 +53,21 @@ class AnalysisService(object):
                          'geojson': geojson}
             }
 
-        return request_to_microservice(config)
+        cached = _analyses.get(config)
+        if cached is not None:
+            return cached
+
+        # queries are read-only, so slow calls may be hedged
+        try:
+            response = request_upstream('query', config, hedge=True)
+        except UpstreamUnavailable:
+            response = _analyses.get_stale(config)
+            if response is None:
+                raise
+            circuit_breaker.mark_stale('query')
+            return response
+
+        if not response.get('errors'):
+            _analyses.set(config, response)
+
+        return response
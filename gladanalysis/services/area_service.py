@@ -1,15 +1,36 @@
+import numbers
 from functools import partial
 
 import pyproj
 from shapely.geometry import shape
 from shapely.ops import transform
 
+from gladanalysis.config import settings
+from gladanalysis.utils import slow_requests
+from gladanalysis.utils.geometry_pool import GeometryPool
+
+
+def _tabulate_area(geojson):
+    # module level so it can be pickled and executed by the geometry pool
+    return AreaService.tabulate_area_inline(geojson)
+
 
 class AreaService(object):
     """Class for tabulating area of polygon without using the geostore"""
 
     @staticmethod
     def tabulate_area(geojson):
+        vertices = AreaService.count_vertices(geojson)
+        slow_requests.record_vertices(vertices)
+
+        # large geometries would block the gevent worker, so compute them in the geometry pool
+        if vertices >= settings.get('geometry', {}).get('offload_vertices'):
+            return GeometryPool.run(_tabulate_area, geojson)
+
+        return AreaService.tabulate_area_inline(geojson)
+
+    @staticmethod
+    def tabulate_area_inline(geojson):
 
         area_ha = 0
 
@@ -26,6 +47,26 @@ class AreaService(object):
 
         return area_ha
 
+    @staticmethod
+    def count_vertices(geojson):
+        # walk the coordinate arrays without building shapely objects
+        if geojson['type'] == 'FeatureCollection':
+            geometries = [feature['geometry'] for feature in geojson['features']]
+        else:
+            geometries = [geojson['geometry']]
+
+        count = 0
+        stack = [geom.get('coordinates', []) for geom in geometries if geom]
+
+        while stack:
+            coords = stack.pop()
+            if coords and isinstance(coords[0], numbers.Number):
+                count += 1
+            else:
+                stack.extend(coords)
+
+        return count
+
     @staticmethod
     def get_polygon_area(geom):
         # source: https://gis.stackexchange.com/a/166421/30899
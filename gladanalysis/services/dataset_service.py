@@ -0,0 +1,21 @@
+from gladanalysis.config import settings
+
+
+class DatasetService(object):
+    """Class for reading the registry of alert datasets
+    Each dataset has its ids, the column holding the julian day of alerts and a
+    confidence filter appended to its queries."""
+
+    @staticmethod
+    def get(name):
+        """config of the dataset, None if it is unknown or not configured"""
+
+        config = settings.get('datasets', {}).get(name)
+        if not config or not config.get('dataset_id'):
+            return None
+
+        return dict(config, name=name)
+
+    @staticmethod
+    def available():
+        return sorted(name for name in settings.get('datasets', {}) if DatasetService.get(name))
@@ -3,7 +3,13 @@ import datetime
 import json
 import logging
 
-from RWAPIMicroservicePython import request_to_microservice
+from gladanalysis.errors import UpstreamUnavailable
+from gladanalysis.utils import circuit_breaker
+from gladanalysis.utils.cache import Cache
+from gladanalysis.utils.upstream import request_upstream
+
+# date queries only change when new alerts are ingested
+_dates = Cache('dates', 'date_ttl', keep_stale=True)
 
 
 class DateService(object):
@@ -42,25 +48,49 @@ class DateService(object):
 
     @staticmethod
     def get_date(datasetID, sql, value):
+        return DateService.get_dates(datasetID, [(sql, value)])[0]
+
+    @staticmethod
+    def get_dates(datasetID, queries):
+        """run independent (sql, value) date queries, reading and storing them in the cache in one batch"""
+
+        keys = [(datasetID, sql, value) for sql, value in queries]
+        cached = _dates.get_many(keys)
+        fetched = {}
 
-        uri = "/query/%s" % (datasetID) + sql + '&format=json'
+        for key in keys:
+            if key in cached:
+                continue
 
-        config = {
-            'uri': uri,
-            'method': 'GET'
-        }
-        logging.info('Making request to other MS: ' + json.dumps(config))
+            uri = "/query/%s" % (datasetID) + key[1] + '&format=json'
+
+            config = {
+                'uri': uri,
+                'method': 'GET'
+            }
+            logging.info('Making request to other MS: ' + json.dumps(config))
+
+            try:
+                values = request_upstream('query', config, hedge=True)
+            except UpstreamUnavailable:
+                stale = _dates.get_stale(key)
+                if stale is None:
+                    raise
+                circuit_breaker.mark_stale('query')
+                cached[key] = stale
+                continue
 
-        values = request_to_microservice(config)
-        date_value = values['data'][0][value]
-        return date_value
+            fetched[key] = values['data'][0][key[2]]
+
+        if fetched:
+            _dates.set_many(fetched)
+
+        return [cached[key] if key in cached else fetched[key] for key in keys]
 
     @staticmethod
-    def get_min_max_date(value, datasetID, indexID):
+    def get_max_date(value, datasetID, indexID):
 
-        # set variables for alert values
         max_value = 'MAX({})'.format(value)
-        min_value = 'MIN({})'.format(value)
 
         # Get max year from database
         max_year_sql = '?sql=select MAX(year)from {}'.format(indexID)
@@ -70,13 +100,34 @@ class DateService(object):
         max_sql = '?sql=select {}from {} where year = {}'.format(max_value, indexID, max_year)
         max_julian = DateService.get_date(datasetID, max_sql, max_value)
 
-        # Get min year from database
+        return max_year, max_julian
+
+    @staticmethod
+    def get_latest_date(datasetID, indexID, value='day'):
+        """latest alert date formatted as YYYY-MM-DD"""
+
+        max_year, max_julian = DateService.get_max_date(value, datasetID, indexID)
+        year, month, day = DateService.julian_day_to_date(max_year, max_julian)
+
+        return '%04d-%02d-%02d' % (int(year), month, day)
+
+    @staticmethod
+    def get_min_max_date(value, datasetID, indexID):
+
+        # set variables for alert values
+        max_value = 'MAX({})'.format(value)
+        min_value = 'MIN({})'.format(value)
+
+        # Get max and min year from database
+        max_year_sql = '?sql=select MAX(year)from {}'.format(indexID)
         min_year_sql = '?sql=select MIN(year)from {} WHERE year > 2000'.format(indexID)
-        min_year = DateService.get_date(datasetID, min_year_sql, 'MIN(year)')
+        max_year, min_year = DateService.get_dates(datasetID, [(max_year_sql, 'MAX(year)'),
+                                                               (min_year_sql, 'MIN(year)')])
 
-        # Get min date from database
+        # Get max and min julian date from database
+        max_sql = '?sql=select {}from {} where year = {}'.format(max_value, indexID, max_year)
         min_day_sql = '?sql=select {}from {} where year = {}'.format(min_value, indexID, min_year)
-        min_julian = DateService.get_date(datasetID, min_day_sql, min_value)
+        max_julian, min_julian = DateService.get_dates(datasetID, [(max_sql, max_value), (min_day_sql, min_value)])
 
         return min_year, min_julian, max_year, max_julian
 
@@ -0,0 +1,85 @@
+import csv
+import logging
+import mmap
+import struct
+import sys
+
+HEADER = struct.Struct('<4sI')
+RECORD = struct.Struct('<3sHHd')
+MAGIC = b'GADM'
+
+
+class GadmAreaService(object):
+    """Class for looking up the area in hectares of gadm36 units from a precomputed table
+    The table is a sorted array of fixed size (iso, adm1, adm2, areaHa) records, memory mapped
+    so every gunicorn worker shares the same pages. Missing adm1/adm2 levels are stored as 0."""
+
+    _map = None
+    _size = 0
+
+    @staticmethod
+    def load(path):
+
+        with open(path, 'rb') as table_file:
+            table = mmap.mmap(table_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, size = HEADER.unpack_from(table, 0)
+        if magic != MAGIC:
+            raise ValueError('{} is not a gadm area table'.format(path))
+
+        GadmAreaService._map = table
+        GadmAreaService._size = size
+        logging.info('[GADM]: loaded {} unit areas from {}'.format(size, path))
+
+    @staticmethod
+    def _key(iso_code, admin_id=None, dist_id=None):
+        return iso_code.upper().encode('ascii'), int(admin_id or 0), int(dist_id or 0)
+
+    @staticmethod
+    def lookup(iso_code, admin_id=None, dist_id=None):
+        """area in hectares of the unit, None if no table is loaded or the unit is unknown"""
+
+        table = GadmAreaService._map
+        if table is None:
+            return None
+
+        try:
+            key = GadmAreaService._key(iso_code, admin_id, dist_id)
+        except (ValueError, UnicodeError):
+            # not a gadm36 unit id, left to the geostore
+            return None
+
+        low, high = 0, GadmAreaService._size
+
+        # binary search over the sorted records
+        while low < high:
+            middle = (low + high) // 2
+            record = RECORD.unpack_from(table, HEADER.size + middle * RECORD.size)
+
+            if record[:3] < key:
+                low = middle + 1
+            elif record[:3] > key:
+                high = middle
+            else:
+                return record[3]
+
+        return None
+
+    @staticmethod
+    def write(path, rows):
+        """write (iso, adm1, adm2, area_ha) rows to a table file"""
+
+        records = sorted((GadmAreaService._key(iso, adm1, adm2), float(area)) for iso, adm1, adm2, area in rows)
+
+        with open(path, 'wb') as table_file:
+            table_file.write(HEADER.pack(MAGIC, len(records)))
+            for key, area in records:
+                table_file.write(RECORD.pack(key[0], key[1], key[2], area))
+
+
+if __name__ == '__main__':
+    # build a table from a csv with iso,adm1,adm2,area_ha columns (adm1/adm2 empty for upper levels):
+    # python -m gladanalysis.services.gadm_area_service gadm36_areas.csv gadm36_areas.bin
+    with open(sys.argv[1]) as csv_file:
+        reader = csv.DictReader(csv_file)
+        GadmAreaService.write(sys.argv[2], ((row['iso'], row['adm1'], row['adm2'], row['area_ha']) for row in reader))
@@ -1,6 +1,16 @@
-from RWAPIMicroservicePython import request_to_microservice
+import hashlib
+import json
 
-from gladanalysis.errors import GeostoreNotFound
+from gladanalysis.errors import GeostoreNotFound, DeadlineExceeded, UpstreamUnavailable
+from gladanalysis.services.gadm_area_service import GadmAreaService
+from gladanalysis.utils import circuit_breaker
+from gladanalysis.utils.cache import Cache
+from gladanalysis.utils.upstream import request_upstream
+
+# geostores are immutable, admin/wdpa/use geometries only change with new releases
+_geostores = Cache('geostore', 'geostore_ttl', keep_stale=True)
+# geostore ids of geometries registered by this service, keyed by geometry hash
+_registered = Cache('geostore-ids', 'geostore_id_ttl')
 
 
 class GeostoreService(object):
@@ -16,8 +26,20 @@ class GeostoreService(object):
             'method': 'GET'
         }
 
+        cached = _geostores.get(uri)
+        if cached is not None:
+            return cached
+
         try:
-            response = request_to_microservice(config)
+            response = request_upstream('geostore', config, hedge=True)
+        except UpstreamUnavailable:
+            response = _geostores.get_stale(uri)
+            if response is None:
+                raise
+            circuit_breaker.mark_stale('geostore')
+            return response
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             raise Exception(str(e))
 
@@ -28,8 +50,38 @@ class GeostoreService(object):
             else:
                 raise Exception(error.get('detail'))
 
+        _geostores.set(uri, response)
         return response
 
+    @staticmethod
+    def register_geojson(geojson):
+        """geostore id and area of a geometry, creating the geostore the first time it is seen"""
+
+        geojson_hash = hashlib.sha1(json.dumps(geojson, sort_keys=True).encode('utf-8')).hexdigest()
+        registered = _registered.get(geojson_hash)
+        if registered is not None:
+            return registered['id'], registered['areaHa']
+
+        config = {
+            'ignore_version': True,
+            'uri': '/v2/geostore',
+            'method': 'POST',
+            'body': {'geojson': geojson}
+        }
+        response = request_upstream('geostore', config)
+
+        if response.get('errors'):
+            raise Exception(response.get('errors')[0].get('detail'))
+
+        geostore = response['data']['id']
+        area = response['data']['attributes']['areaHa']
+
+        # later lookups of the new geostore (area, geometry) are answered from the cache
+        _geostores.set("/geostore/%s" % (geostore), response)
+        _registered.set(geojson_hash, {'id': geostore, 'areaHa': area})
+
+        return geostore, area
+
     @staticmethod
     def make_use_request(use_type, use_id):
 
@@ -43,6 +95,11 @@ class GeostoreService(object):
     @staticmethod
     def make_gadm_request(iso_code, admin_id=None, dist_id=None):
 
+        # gadm36 areas are static, use the bundled table when it knows the unit
+        area_ha = GadmAreaService.lookup(iso_code, admin_id, dist_id)
+        if area_ha is not None:
+            return area_ha
+
         if not admin_id and not dist_id:
             uri = "/geostore/admin/%s?simplify=0.05" % (iso_code)
 
@@ -65,6 +122,15 @@ class GeostoreService(object):
         area = area_resp['data']['attributes']['areaHa']
         return area
 
+    @staticmethod
+    def get_geojson(geostore):
+
+        # same uri as make_area_request, so the area lookup already cached it
+        uri = "/geostore/%s" % (geostore)
+        geostore_data = GeostoreService.execute(uri)
+
+        return geostore_data['data']['attributes']['geojson']
+
     @staticmethod
     def make_wdpa_request(wdpa_id):
 
@@ -17,19 +17,42 @@ class QueryConstructorService(object):
         else:
             where_template = 'WHERE ((year = {y1} and {day} >= {d1}) or (year >= {y1_plus_1} and year <= {y2_minus_1}) or (year = {y2} and {day} <= {d2}))' + confidence
 
+        where_template += QueryConstructorService.format_geog_filter(iso, state, dist)
+
+        where_sql = where_template.format(y1=int(from_year), d1=int(from_date), y1_plus_1=(int(from_year) + 1),
+                                          y2=int(to_year), d2=int(to_date), y2_minus_1=(int(to_year) - 1),
+                                          day=day_value)
+
+        sql = ''.join(filter(None, [count_sql, from_sql, where_sql, groupby_sql]))
+        download_sql = '?sql=' + ''.join([select_sql, from_sql, where_sql, order_sql])
+
+        return sql, download_sql
+
+    @staticmethod
+    def format_geog_filter(iso=None, state=None, dist=None):
+
+        geog_sql = ''
         geog_id_list = ['country_iso', 'state_id', 'dist_id']
         geog_val_list = [iso, state, dist]
 
         for geog_name, geog_value in zip(geog_id_list, geog_val_list):
             if geog_value:
                 if geog_name == 'country_iso':
-                    where_template += " AND ({} = '{}')".format(geog_name, geog_value)
+                    geog_sql += " AND ({} = '{}')".format(geog_name, geog_value)
                 else:
-                    where_template += ' AND ({} = {})'.format(geog_name, geog_value)
+                    geog_sql += ' AND ({} = {})'.format(geog_name, geog_value)
 
-        where_sql = where_template.format(y1=int(from_year), d1=int(from_date), y1_plus_1=(int(from_year) + 1),
-                                          y2=int(to_year), d2=int(to_date), y2_minus_1=(int(to_year) - 1),
-                                          day=day_value)
+        return geog_sql
+
+    @staticmethod
+    def format_dataset_tail_query(day_value, confidence, since_year, since_date, count_sql, from_sql, select_sql,
+                                  order_sql, groupby_sql, iso=None, state=None, dist=None):
+        """same as format_dataset_query, for every alert strictly after since_year/since_date"""
+
+        where_template = 'WHERE ((year = {y1} and {day} > {d1}) or (year > {y1}))' + confidence
+        where_template += QueryConstructorService.format_geog_filter(iso, state, dist)
+
+        where_sql = where_template.format(y1=int(since_year), d1=int(since_date), day=day_value)
 
         sql = ''.join(filter(None, [count_sql, from_sql, where_sql, groupby_sql]))
         download_sql = '?sql=' + ''.join([select_sql, from_sql, where_sql, order_sql])
@@ -37,26 +60,68 @@ class QueryConstructorService(object):
         return sql, download_sql
 
     @staticmethod
-    def format_terrai_sql(from_year, from_date, to_year, to_date, iso=None, state=None, dist=None, agg_values=False):
+    def format_terrai_sql(from_year, from_date, to_year, to_date, iso=None, state=None, dist=None, agg_values=False,
+                          since=False):
+        """with since, from_year/from_date is the last date seen by the client and to_year/to_date are ignored"""
 
-        select_sql = 'SELECT lat, long, country_iso, state_id, dist_id, year, day '
+        dataset = {'index_id': os.getenv('TERRAI_INDEX_ID'), 'day_column': 'day', 'confidence': ''}
+
+        return QueryConstructorService.format_alerts_sql(dataset, from_year, from_date, to_year, to_date, iso, state,
+                                                         dist, agg_values, since)
+
+    @staticmethod
+    def format_alerts_sql(dataset, from_year, from_date, to_year, to_date, iso=None, state=None, dist=None,
+                          agg_values=False, since=False):
+        """same as format_terrai_sql for any dataset of the registry (see DatasetService)"""
+
+        day = dataset['day_column']
+        select_sql = 'SELECT lat, long, country_iso, state_id, dist_id, year, {} '.format(day)
 
         if agg_values:
-            count_sql = 'SELECT year, day, count(*)'
+            count_sql = 'SELECT year, {}, count(*)'.format(day)
         else:
-            count_sql = 'SELECT count(day) '
+            count_sql = 'SELECT count({}) '.format(day)
 
-        from_sql = 'FROM {} '.format(os.getenv('TERRAI_INDEX_ID'))
-        order_sql = 'ORDER BY year, day'
+        from_sql = 'FROM {} '.format(dataset['index_id'])
+        order_sql = 'ORDER BY year, {}'.format(day)
 
         if agg_values:
-            groupby_sql = 'GROUP BY year, day'
+            groupby_sql = 'GROUP BY year, {}'.format(day)
         else:
             groupby_sql = None
 
+        if since:
+            # narrow tail query for clients polling for new alerts
+            return QueryConstructorService.format_dataset_tail_query(day, dataset['confidence'], from_year, from_date,
+                                                                     count_sql, from_sql, select_sql, order_sql,
+                                                                     groupby_sql, iso=iso, state=state, dist=dist)
+
+        sql, download_sql = QueryConstructorService.format_dataset_query(day, dataset['confidence'], from_year,
+                                                                         from_date, to_year, to_date, count_sql,
+                                                                         from_sql, select_sql, order_sql, groupby_sql,
+                                                                         iso=iso, state=state, dist=dist)
+
+        return sql, download_sql
+
+    @staticmethod
+    def format_terrai_drilldown_sql(from_year, from_date, to_year, to_date, group_column, iso=None, state=None,
+                                    agg_values=False):
+        """counts of every child unit (group_column: country_iso, state_id or dist_id) in a single query"""
+
+        select_sql = 'SELECT lat, long, country_iso, state_id, dist_id, year, day '
+
+        if agg_values:
+            count_sql = 'SELECT {}, year, day, count(*)'.format(group_column)
+            groupby_sql = 'GROUP BY {}, year, day'.format(group_column)
+        else:
+            count_sql = 'SELECT {}, count(day) '.format(group_column)
+            groupby_sql = 'GROUP BY {}'.format(group_column)
+
+        from_sql = 'FROM {} '.format(os.getenv('TERRAI_INDEX_ID'))
+        order_sql = 'ORDER BY year, day'
+
         sql, download_sql = QueryConstructorService.format_dataset_query("day", "", from_year, from_date, to_year,
                                                                          to_date, count_sql, from_sql, select_sql,
-                                                                         order_sql, groupby_sql, iso=iso, state=state,
-                                                                         dist=dist)
+                                                                         order_sql, groupby_sql, iso=iso, state=state)
 
         return sql, download_sql
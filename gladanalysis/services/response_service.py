@@ -1,21 +1,65 @@
+import datetime
 import os
 
+COLUMNAR_MIMETYPE = 'application/vnd.columnar+json'
+COLUMN_ORDER = ['year', 'alert_date', 'julian_day', 'week', 'month', 'quarter', 'count', 'rolling_count',
+                'cumulative_count', 'previous_count', 'change']
+
 
 class ResponseService(object):
     """Class for standardizing api responses"""
 
+    @staticmethod
+    def requested_format(args, accept=None):
+        # explicit format parameter first, then the Accept header
+        if args.get('format'):
+            return args.get('format').lower()
+
+        if accept and COLUMNAR_MIMETYPE in accept:
+            return 'columnar'
+
+        return 'json'
+
+    @staticmethod
+    def to_columnar(rows, delta_dates=False):
+        """convert a list of records to parallel arrays per column
+        with delta_dates, alert_date holds the first date and the day offsets between consecutive rows"""
+
+        if not rows:
+            return {}
+
+        columns = sorted(rows[0].keys(), key=lambda col: COLUMN_ORDER.index(col) if col in COLUMN_ORDER else 99)
+        table = dict((col, [row[col] for row in rows]) for col in columns)
+        table['columns'] = columns
+
+        if delta_dates and 'alert_date' in table:
+            dates = [datetime.datetime.strptime(d, '%Y-%m-%d') for d in table['alert_date']]
+            table['alert_date'] = {'start': table['alert_date'][0],
+                                   'deltas': [(date - prev).days for prev, date in zip(dates, dates[1:])]}
+
+        return table
+
     @staticmethod
     def standardize_response(name, data, datasetID, count=None, download_sql=None, area=None, geostore=None, agg=None,
-                             agg_by=None, period=None):
+                             agg_by=None, period=None, columnar=False, delta_dates=False, since=None,
+                             latest_date=None):
         # Helper function to standardize API responses
         standard_format = {}
-        standard_format["type"] = "terrai-alerts"
-        standard_format["id"] = '{}'.format(os.getenv('TERRAI_DATASET_ID'))
+        standard_format["type"] = "{}-alerts".format(name.lower())
+        standard_format["id"] = '{}'.format(datasetID)
         if period:
             standard_format['period'] = period
+        if since:
+            standard_format['since'] = since
         standard_format["attributes"] = {}
+        if latest_date:
+            # clients pass it back as since on their next poll
+            standard_format["attributes"]["latestDate"] = latest_date
         if agg:
             standard_format['aggregate_values'] = True
+            if columnar:
+                standard_format['format'] = 'columnar'
+                data = ResponseService.to_columnar(data, delta_dates)
             standard_format["attributes"]["value"] = data
 
         if agg_by:
@@ -61,3 +105,32 @@ class ResponseService(object):
         response.append(info)
 
         return response
+
+    @staticmethod
+    def format_drilldown(name, groups, level, period=None, iso=None, state=None, agg_by=None):
+        response = {}
+        response['type'] = 'terrai-alerts'
+        response['id'] = '{}'.format(os.getenv('TERRAI_DATASET_ID'))
+        if period:
+            response['period'] = period
+        if agg_by:
+            response['aggregate_values'] = True
+            response['aggregate_by'] = agg_by
+        response['attributes'] = {}
+        response['attributes']['level'] = level
+        if iso:
+            response['attributes']['iso'] = iso
+        if state:
+            response['attributes']['adm1'] = state
+        response['attributes']['value'] = groups
+
+        return response
+
+    @staticmethod
+    def format_job(job_id, state):
+        response = {}
+        response['type'] = 'terrai-alerts-job'
+        response['id'] = job_id
+        response['attributes'] = dict(state)
+
+        return response
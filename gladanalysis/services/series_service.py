@@ -0,0 +1,109 @@
+import datetime
+import hashlib
+import json
+from bisect import bisect_left, bisect_right
+
+from gladanalysis.services.analysis_service import AnalysisService
+from gladanalysis.services.date_service import DateService
+from gladanalysis.services.query_constructor_service import QueryConstructorService
+from gladanalysis.utils.cache import Cache
+
+_series = Cache('series', 'series_ttl')
+
+
+class SeriesService(object):
+    """Class for answering any period of an area from its cached daily series
+    The full (year, day, count) series of an area is fetched once and cached as the sorted
+    ordinals of days with alerts plus the cumulative sum of their counts, so period totals
+    are a difference of two cumulative values and rollups a slice of the series. Only days
+    after the cached latest date are fetched when new alerts are ingested."""
+
+    @staticmethod
+    def area_key(dataset_id, geostore=None, geojson=None, iso=None, state=None, dist=None):
+        geojson_hash = None
+        if geojson:
+            geojson_hash = hashlib.sha1(json.dumps(geojson, sort_keys=True).encode('utf-8')).hexdigest()
+
+        return dataset_id, geostore, geojson_hash, iso, state, dist
+
+    @staticmethod
+    def extend(series, rows):
+        """append (year, day, count) query rows for days after the series' last day"""
+
+        days, cumsum = series['days'], series['cumsum']
+        parsed = []
+
+        for row in rows:
+            count_column = [col for col in row if col not in ('year', 'day')][0]
+            ordinal = (datetime.date(int(row['year']), 1, 1) + datetime.timedelta(days=int(row['day']) - 1)).toordinal()
+            parsed.append((ordinal, int(row[count_column])))
+
+        total = cumsum[-1] if cumsum else 0
+        for ordinal, count in sorted(parsed):
+            if days and ordinal <= days[-1]:
+                continue
+
+            total += count
+            days.append(ordinal)
+            cumsum.append(total)
+
+        return series
+
+    @staticmethod
+    def get_series(dataset_id, index_id, geostore=None, geojson=None, iso=None, state=None, dist=None):
+
+        key = SeriesService.area_key(dataset_id, geostore, geojson, iso, state, dist)
+        latest_date = DateService.get_latest_date(dataset_id, index_id)
+        series = _series.get(key)
+
+        if series is not None and series['latest'] >= latest_date:
+            return series
+
+        if series is None:
+            series = {'days': [], 'cumsum': []}
+            to_year, to_date = DateService.date_to_julian_day('{0},{0}'.format(latest_date))[:2]
+            sql = QueryConstructorService.format_terrai_sql(2004, 1, to_year, to_date, iso, state, dist,
+                                                            agg_values=True)[0]
+        else:
+            # only the days ingested since the series was cached
+            since_year, since_date = DateService.date_to_julian_day('{0},{0}'.format(series['latest']))[:2]
+            series = {'days': list(series['days']), 'cumsum': list(series['cumsum'])}
+            sql = QueryConstructorService.format_terrai_sql(since_year, since_date, None, None, iso, state, dist,
+                                                            agg_values=True, since=True)[0]
+
+        data = AnalysisService.make_analysis_request(dataset_id, sql, geostore, geojson)
+        series = SeriesService.extend(series, data['data'])
+        series['latest'] = latest_date
+        _series.set(key, series)
+
+        return series
+
+    @staticmethod
+    def _bounds(series, period):
+        period_from, period_to = [datetime.datetime.strptime(date, '%Y-%m-%d').toordinal()
+                                  for date in period.split(',')]
+        return bisect_left(series['days'], period_from), bisect_right(series['days'], period_to)
+
+    @staticmethod
+    def total(series, period):
+        """number of alerts in the period"""
+
+        start, end = SeriesService._bounds(series, period)
+        if end == 0 or start >= end:
+            return 0
+
+        return series['cumsum'][end - 1] - (series['cumsum'][start - 1] if start else 0)
+
+    @staticmethod
+    def rows(series, period):
+        """(year, day, count) rows of the period, as returned by the aggregated query"""
+
+        start, end = SeriesService._bounds(series, period)
+        rows = []
+
+        for index in range(start, end):
+            date = datetime.date.fromordinal(series['days'][index])
+            count = series['cumsum'][index] - (series['cumsum'][index - 1] if index else 0)
+            rows.append({'year': date.year, 'day': date.timetuple().tm_yday, 'COUNT(*)': count})
+
+        return rows
@@ -1,10 +1,16 @@
+import datetime
+
+import numpy as np
 import pandas as pd
 
 
 class SummaryService(object):
     """Class for creating summary stats on terrai data
     Takes data from the router and aggregates alerts by user specified intervals
-    (day, week, month, year)"""
+    (day, week, month, year), or computes rolling, cumulative and year over year statistics"""
+
+    # aggregate_by values computed from the daily counts of a longer period, see statistics_period
+    STATISTICS = ['rolling', 'cumulative', 'yoy']
 
     @staticmethod
     def create_time_table(dataset, data, agg_type):
@@ -46,3 +52,89 @@ class SummaryService(object):
             grouped = df.groupby(groupby_list).sum()['count'].reset_index()
 
             return grouped.to_dict(orient='records')
+
+    @staticmethod
+    def statistics_period(agg_type, period, window=7):
+        """period to query for the statistics of period: rolling sums need the window - 1 days before it,
+        year over year comparisons the year before it"""
+
+        period_from, period_to = period.split(',')
+        start = datetime.datetime.strptime(period_from, '%Y-%m-%d')
+
+        if agg_type == 'rolling':
+            start -= datetime.timedelta(days=window - 1)
+        elif agg_type == 'yoy':
+            start = (pd.Timestamp(start) - pd.DateOffset(years=1)).to_pydatetime()
+
+        return '{},{}'.format(start.strftime('%Y-%m-%d'), period_to)
+
+    @staticmethod
+    def create_statistics(dataset, data, agg_type, period, window=7):
+        """statistics of the alerts of period from the (year, day) counts of statistics_period
+        rolling: alerts of every day and of the window days up to it
+        cumulative: alerts since the start of the period, on the days it changes
+        yoy: alerts of every month and of the same days a year earlier"""
+
+        start, end = [pd.Timestamp(date) for date in period.split(',')]
+        query_start = pd.Timestamp(SummaryService.statistics_period(agg_type, period, window).split(',')[0])
+
+        # every day of the queried period, days without alerts count 0
+        days = pd.date_range(query_start, end)
+        if data['data']:
+            df = pd.DataFrame(data['data']).rename(columns={'COUNT(*)': 'count', 'day': 'julian_day'})
+            dates = pd.to_datetime(df.year, format='%Y') + pd.to_timedelta(df.julian_day - 1, unit='d')
+            daily = df['count'].groupby(dates.values).sum().reindex(days, fill_value=0)
+        else:
+            daily = pd.Series(0, index=days)
+
+        if agg_type == 'rolling':
+            rolling = daily.rolling(window, min_periods=1).sum()[start:end]
+            daily = daily[start:end]
+            return [{'alert_date': date.strftime('%Y-%m-%d'), 'count': int(count), 'rolling_count': int(total)}
+                    for date, count, total in zip(daily.index, daily.values, rolling.values)]
+
+        if agg_type == 'cumulative':
+            daily = daily[start:end]
+            cumulative = daily.cumsum()[daily > 0]
+            return [{'alert_date': date.strftime('%Y-%m-%d'), 'count': int(count), 'cumulative_count': int(total)}
+                    for date, count, total in zip(cumulative.index, daily[daily > 0].values, cumulative.values)]
+
+        months = pd.period_range(start, end, freq='M')
+        current = daily[start:end]
+        current = current.groupby(current.index.to_period('M')).sum().reindex(months, fill_value=0)
+
+        # days of the previous year are moved a year forward to fall in the month they're compared to
+        previous = daily[start - pd.DateOffset(years=1):end - pd.DateOffset(years=1)]
+        previous.index = previous.index + pd.DateOffset(years=1)
+        previous = previous.groupby(previous.index.to_period('M')).sum().reindex(months, fill_value=0)
+
+        change = (current - previous) / previous.replace(0, np.nan)
+
+        return [{'year': int(month.year), 'month': int(month.month), 'count': int(count),
+                 'previous_count': int(previous_count), 'change': None if np.isnan(ratio) else round(ratio, 4)}
+                for month, count, previous_count, ratio in zip(months, current.values, previous.values, change.values)]
+
+    @staticmethod
+    def create_group_table(dataset, data, group_column, agg_type=None):
+        """split grouped query results per unit of group_column
+        returns [{'id': unit, 'count': total}] sorted by count, with the time table of each unit if agg_type is set"""
+
+        if not data['data']:
+            return []
+
+        df = pd.DataFrame(data['data'])
+        count_column = [col for col in df.columns if col not in (group_column, 'year', 'day')][0]
+        df = df.rename(columns={count_column: 'COUNT(*)'})
+
+        groups = []
+        for unit, unit_df in df.groupby(group_column):
+            # numpy scalars aren't JSON serializable
+            group = {'id': unit.item() if hasattr(unit, 'item') else unit, 'count': int(unit_df['COUNT(*)'].sum())}
+
+            if agg_type:
+                records = unit_df[['year', 'day', 'COUNT(*)']].to_dict(orient='records')
+                group['value'] = SummaryService.create_time_table(dataset, {'data': records}, agg_type)
+
+            groups.append(group)
+
+        return sorted(groups, key=lambda group: group['count'], reverse=True)
@@ -0,0 +1,137 @@
+import csv
+import datetime
+import logging
+import math
+import sqlite3
+import sys
+
+from shapely.geometry import box, shape
+from shapely.ops import unary_union
+from shapely.prepared import prep
+
+from gladanalysis.config import settings
+
+SCHEMA = ['CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)',
+          'CREATE TABLE tiles (zoom INTEGER, x INTEGER, y INTEGER, date INTEGER, count INTEGER, '
+          'PRIMARY KEY (zoom, x, y, date))']
+
+
+class TileService(object):
+    """Class for estimating alert counts from a local pyramid of daily counts per grid tile
+    Zoom 0 tiles are tile_size degrees wide and every level halves them. Tiles fully inside
+    the geometry are counted as is, partially covered ones are refined at the next level and
+    weighted by their covered share at the last one. Alerts of weighted tiles may all be in
+    or out of the geometry, which bounds the error of the estimate."""
+
+    @staticmethod
+    def available():
+        return bool(settings.get('tiles', {}).get('path'))
+
+    @staticmethod
+    def _connect():
+        connection = sqlite3.connect(settings['tiles']['path'])
+        meta = dict(connection.execute('SELECT key, value FROM meta').fetchall())
+        return connection, int(meta['max_zoom']), float(meta['tile_size'])
+
+    @staticmethod
+    def _geometry(geojson):
+        if geojson['type'] == 'FeatureCollection':
+            return unary_union([shape(feature['geometry']) for feature in geojson['features']])
+        if geojson['type'] == 'Feature':
+            return shape(geojson['geometry'])
+        return shape(geojson)
+
+    @staticmethod
+    def estimate(geojson, from_date, to_date):
+        """(estimated count, error bound) of alerts inside the geometry between two datetime.date"""
+
+        geometry = TileService._geometry(geojson)
+        prepared = prep(geometry)
+        connection, max_zoom, tile_size = TileService._connect()
+
+        total, error_bound = 0.0, 0.0
+        candidates = None
+
+        try:
+            for zoom in range(max_zoom + 1):
+                size = tile_size / 2 ** zoom
+                minx, miny, maxx, maxy = geometry.bounds
+
+                # counts of the tiles of this level over the bounding box, empty tiles aren't stored
+                rows = connection.execute(
+                    'SELECT x, y, SUM(count) FROM tiles WHERE zoom = ? AND x BETWEEN ? AND ? AND y BETWEEN ? AND ? '
+                    'AND date BETWEEN ? AND ? GROUP BY x, y',
+                    (zoom, int(math.floor((minx + 180) / size)), int(math.floor((maxx + 180) / size)),
+                     int(math.floor((miny + 90) / size)), int(math.floor((maxy + 90) / size)),
+                     from_date.toordinal(), to_date.toordinal())).fetchall()
+
+                partial = set()
+                for x, y, count in rows:
+                    # only refine tiles whose parent was partially covered
+                    if candidates is not None and (x // 2, y // 2) not in candidates:
+                        continue
+
+                    tile = box(x * size - 180, y * size - 90, (x + 1) * size - 180, (y + 1) * size - 90)
+
+                    if prepared.contains(tile):
+                        total += count
+                    elif not prepared.intersects(tile):
+                        continue
+                    elif zoom < max_zoom:
+                        partial.add((x, y))
+                    else:
+                        share = geometry.intersection(tile).area / tile.area
+                        total += count * share
+                        error_bound += count * max(share, 1 - share)
+
+                if not partial:
+                    break
+                candidates = partial
+        finally:
+            connection.close()
+
+        return int(round(total)), int(math.ceil(error_bound))
+
+    @staticmethod
+    def build(path, alerts, max_zoom=4, tile_size=1.0):
+        """write a pyramid of the (lat, long, year, julian day) alerts to a sqlite file"""
+
+        counts = {}
+        size = tile_size / 2 ** max_zoom
+        for lat, lon, year, day in alerts:
+            date = (datetime.date(int(year), 1, 1) + datetime.timedelta(days=int(day) - 1)).toordinal()
+            key = (int(math.floor((float(lon) + 180) / size)), int(math.floor((float(lat) + 90) / size)), date)
+            counts[key] = counts.get(key, 0) + 1
+
+        connection = sqlite3.connect(path)
+        try:
+            for statement in SCHEMA:
+                connection.execute(statement)
+            connection.executemany('INSERT INTO meta VALUES (?, ?)',
+                                   [('max_zoom', str(max_zoom)), ('tile_size', str(tile_size))])
+
+            for zoom in range(max_zoom, -1, -1):
+                connection.executemany('INSERT INTO tiles VALUES (?, ?, ?, ?, ?)',
+                                       ((zoom, x, y, date, count) for (x, y, date), count in counts.items()))
+
+                # parents sum the counts of their four children
+                parents = {}
+                for (x, y, date), count in counts.items():
+                    parent = (x // 2, y // 2, date)
+                    parents[parent] = parents.get(parent, 0) + count
+                counts = parents
+
+            connection.commit()
+        finally:
+            connection.close()
+
+        logging.info('[TILES]: wrote {} levels to {}'.format(max_zoom + 1, path))
+
+
+if __name__ == '__main__':
+    # build a pyramid from a csv export of the alerts with lat,long,year,day columns:
+    # python -m gladanalysis.services.tile_service terrai_alerts.csv terrai_tiles.sqlite [max_zoom]
+    with open(sys.argv[1]) as csv_file:
+        reader = csv.DictReader(csv_file)
+        TileService.build(sys.argv[2], ((row['lat'], row['long'], row['year'], row['day']) for row in reader),
+                          max_zoom=int(sys.argv[3]) if len(sys.argv) > 3 else 4)
@@ -1 +1,5 @@
+from gladanalysis.tests.test_admin import AdminTest
+from gladanalysis.tests.test_services import AreaServiceTest, CacheTest, GadmAreaServiceTest, \
+    QueryConstructorServiceTest, ResponseServiceTest, SeriesServiceTest, SummaryServiceTest, TileServiceTest, \
+    UpstreamTest
 from gladanalysis.tests.test_terrai import TerraiTest
@@ -0,0 +1,96 @@
+"""Local stand-in for a redis server, speaking enough of the protocol for the cache backend"""
+
+import fnmatch
+import threading
+import time
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+
+def bulk(value):
+    if value is None:
+        return b'$-1\r\n'
+    return b'$' + str(len(value)).encode() + b'\r\n' + value + b'\r\n'
+
+
+class RedisStubHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+
+            args = []
+            for _ in range(int(line[1:])):
+                length = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(length + 2)[:-2])
+
+            self.wfile.write(self.server.execute(args))
+
+
+class RedisStub(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        socketserver.ThreadingTCPServer.__init__(self, ('127.0.0.1', 0), RedisStubHandler)
+        self.data = {}
+
+    @property
+    def url(self):
+        return 'redis://127.0.0.1:{}/0'.format(self.server_address[1])
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def lookup(self, key):
+        value, expires = self.data.get(key, (None, None))
+        if expires is not None and expires < time.time():
+            return None
+        return value
+
+    def execute(self, args):
+        command = args[0].upper()
+
+        if command == b'PING':
+            return b'+PONG\r\n'
+
+        elif command == b'GET':
+            return bulk(self.lookup(args[1]))
+
+        elif command == b'MGET':
+            return b'*' + str(len(args) - 1).encode() + b'\r\n' + b''.join(bulk(self.lookup(key)) for key in args[1:])
+
+        elif command == b'SET':
+            options = [arg.upper() for arg in args[3:]]
+            expires = time.time() + int(args[4 + options.index(b'EX')]) if b'EX' in options else None
+            self.data[args[1]] = (args[2], expires)
+            return b'+OK\r\n'
+
+        elif command == b'SCAN':
+            # a single pass, the cursor is always 0
+            options = [arg.upper() for arg in args[2:]]
+            pattern = args[3 + options.index(b'MATCH')].decode() if b'MATCH' in options else '*'
+            keys = [key for key in self.data if fnmatch.fnmatchcase(key.decode(), pattern)]
+            return (b'*2\r\n' + bulk(b'0') + b'*' + str(len(keys)).encode() + b'\r\n' +
+                    b''.join(bulk(key) for key in keys))
+
+        elif command == b'DEL':
+            deleted = [self.data.pop(key, None) for key in args[1:]]
+            return b':' + str(len([value for value in deleted if value is not None])).encode() + b'\r\n'
+
+        elif command == b'FLUSHDB':
+            self.data.clear()
+            return b'+OK\r\n'
+
+        return b'-ERR unknown command\r\n'
@@ -0,0 +1,130 @@
+import json
+import logging
+import unittest
+
+from httmock import HTTMock
+
+from gladanalysis import create_application
+from gladanalysis.config import settings
+from gladanalysis.tests.test_terrai import geostore_mock, query_mock
+from gladanalysis.utils import memory, profiling, slow_requests
+from gladanalysis.utils.cache import get_backend
+
+ADMIN_TOKEN = 'test-admin-token'
+
+
+class AdminTest(unittest.TestCase):
+
+    def setUp(self):
+        app = create_application()
+        app.testing = True
+        app.config['TESTING'] = True
+        app.config['DEBUG'] = False
+        self.app = app.test_client()
+        settings['admin']['token'] = ADMIN_TOKEN
+
+    def tearDown(self):
+        settings['admin']['token'] = None
+
+    def admin_get(self, path, token=ADMIN_TOKEN):
+        return self.app.get('/api/v2/ms/admin/' + path, headers={'x-admin-token': token})
+
+    def test_admin_token(self):
+        '''admin endpoints require the configured token'''
+
+        logging.info('[TEST]: Beginning admin token test')
+        self.assertEqual(self.admin_get('metrics', token='wrong').status_code, 403)
+
+        settings['admin']['token'] = None
+        self.assertEqual(self.admin_get('metrics').status_code, 404)
+
+    def test_metrics(self):
+        '''metrics are returned as counters and timings'''
+
+        response = self.admin_get('metrics')
+        data = json.loads(response.data).get('data')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('counters', data)
+        self.assertIn('timings', data)
+
+    def test_profile(self):
+        '''a request sent with x-profile is profiled and its profile can be downloaded'''
+
+        logging.info('[TEST]: Beginning request profiling test')
+        response = self.app.get('/api/v2/ms/admin/metrics', headers={'x-admin-token': ADMIN_TOKEN, 'x-profile': 'true'})
+        profile_id = response.headers.get('X-Profile-Id')
+        self.assertTrue(profile_id)
+
+        profiles = json.loads(self.admin_get('profiles').data).get('data')
+        self.assertIn(profile_id, [profile['id'] for profile in profiles])
+
+        report = self.admin_get('profiles/{}?format=text'.format(profile_id))
+        self.assertEqual(report.status_code, 200)
+        self.assertIn('function calls', report.data.decode('utf-8'))
+
+        # while another request is profiled the worker's profiler hook is taken
+        profiling._active.acquire()
+        try:
+            response = self.app.get('/api/v2/ms/admin/metrics', headers={'x-admin-token': ADMIN_TOKEN,
+                                                                         'x-profile': 'true'})
+        finally:
+            profiling._active.release()
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.headers.get('X-Profile-Id'))
+
+    def test_profile_requires_token(self):
+        '''x-profile is ignored without the admin token'''
+
+        response = self.app.get('/api/v2/ms/admin/metrics', headers={'x-profile': 'true'})
+        self.assertIsNone(response.headers.get('X-Profile-Id'))
+
+    def test_slow_requests(self):
+        '''requests over the threshold are kept with their queries and upstream calls'''
+
+        logging.info('[TEST]: Beginning slow requests test')
+        get_backend().clear()
+        slow_requests.clear()
+        threshold = settings['slow_requests']['threshold']
+        settings['slow_requests']['threshold'] = 0
+        try:
+            with HTTMock(query_mock):
+                with HTTMock(geostore_mock):
+                    self.app.get('/api/v2/ms/terrai-alerts?geostore=beb8e2f26bd26406fcf2018d343a62c5'
+                                 '&period=2017-01-01,2017-12-30')
+        finally:
+            settings['slow_requests']['threshold'] = threshold
+
+        data = json.loads(self.admin_get('slow-requests').data).get('data')
+        slow_request = data[0]
+
+        self.assertEqual(slow_request['route'], '/api/v2/ms/terrai-alerts')
+        self.assertEqual(slow_request['args']['period'], '2017-01-01,2017-12-30')
+        self.assertIn('count(day)', slow_request['sql'][0])
+        self.assertIn('geostore', [call['name'] for call in slow_request['upstream']])
+        self.assertIn('query', [call['name'] for call in slow_request['upstream']])
+
+    def test_memory(self):
+        '''memory used per route and the allocations that grew are reported'''
+
+        logging.info('[TEST]: Beginning worker memory test')
+        # without tracking only the size of the process is reported
+        data = json.loads(self.admin_get('memory').data).get('data')
+        self.assertFalse(data['enabled'])
+        self.assertNotIn('routes', data)
+
+        settings['memory']['enabled'] = True
+        try:
+            with HTTMock(query_mock, geostore_mock):
+                self.app.get('/api/v2/ms/terrai-alerts?geostore=test')
+
+            response = self.admin_get('memory?limit=5')
+            self.assertEqual(self.admin_get('memory?limit=0').status_code, 400)
+        finally:
+            settings['memory']['enabled'] = False
+        data = json.loads(response.data).get('data')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(data['rss'], 0)
+        self.assertEqual(data['routes']['/api/v2/ms/terrai-alerts']['requests'], 1)
+        self.assertLessEqual(len(data['allocations' if memory.tracemalloc else 'objects']), 5)
@@ -0,0 +1,374 @@
+import datetime
+import logging
+import os
+import tempfile
+import time
+import unittest
+
+import requests
+from flask import g
+from httmock import urlmatch, response, HTTMock
+
+from gladanalysis import create_application
+from gladanalysis.config import settings
+from gladanalysis.services import AreaService, GadmAreaService, GeostoreService, QueryConstructorService, \
+    ResponseService, SeriesService, SummaryService, TileService
+from gladanalysis.tests.redis_stub import RedisStub
+from gladanalysis.errors import DeadlineExceeded, GeometryTimeout, UpstreamUnavailable
+from gladanalysis.utils import circuit_breaker, deadline, metrics, upstream
+from gladanalysis.utils.cache import Cache, MemoryBackend, get_backend, reset_backend
+from gladanalysis.utils.geometry_pool import GeometryPool
+
+POLYGON = {"type": "Polygon",
+           "coordinates": [[[-60.0, -10.0], [-59.0, -10.0], [-59.0, -9.0], [-60.0, -9.0], [-60.0, -10.0]]]}
+
+FEATURE_COLLECTION = {"type": "FeatureCollection",
+                      "features": [{"type": "Feature", "properties": {}, "geometry": POLYGON},
+                                   {"type": "Feature", "properties": {}, "geometry": POLYGON}]}
+
+
+def fail_geometry(message):
+    raise GeometryTimeout(message=message)
+
+
+class AreaServiceTest(unittest.TestCase):
+
+    def test_count_vertices(self):
+        '''count vertices of every feature in a collection'''
+
+        self.assertEqual(AreaService.count_vertices(FEATURE_COLLECTION), 10)
+
+    def test_offloaded_area(self):
+        '''area computed in the geometry pool matches the inline result'''
+
+        logging.info('[TEST]: Beginning geometry pool test')
+        inline = AreaService.tabulate_area_inline(FEATURE_COLLECTION)
+
+        offload_vertices = settings['geometry']['offload_vertices']
+        settings['geometry']['offload_vertices'] = 0
+        try:
+            offloaded = AreaService.tabulate_area(FEATURE_COLLECTION)
+        finally:
+            settings['geometry']['offload_vertices'] = offload_vertices
+
+        self.assertAlmostEqual(inline, offloaded)
+
+    def test_offloaded_error(self):
+        '''errors raised in the geometry pool are raised again in the parent'''
+
+        with self.assertRaises(GeometryTimeout) as raised:
+            GeometryPool.run(fail_geometry, 'too complex')
+
+        self.assertEqual(raised.exception.message, 'too complex')
+
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.redis = RedisStub()
+        self.redis.start()
+        self.cache_settings = dict(settings['cache'])
+        settings['cache'].update({'backend': 'redis', 'redis_url': self.redis.url})
+        reset_backend()
+
+    def tearDown(self):
+        settings['cache'] = self.cache_settings
+        reset_backend()
+        self.redis.stop()
+
+    def test_redis_backend(self):
+        '''values round trip through the shared backend, in batches and compressed when large'''
+
+        logging.info('[TEST]: Beginning redis cache test')
+        cache = Cache('test', 'date_ttl')
+        series = [{'year': 2017, 'julian_day': day, 'count': day % 7} for day in range(1, 366)]
+
+        cache.set_many({('a', 1): 2017, ('b', 2): series})
+
+        self.assertEqual(cache.get_many([('a', 1), ('b', 2), ('c', 3)]), {('a', 1): 2017, ('b', 2): series})
+        self.assertTrue(any(value.startswith(b'z') for value, _ in self.redis.data.values()))
+
+    def test_redis_clear(self):
+        '''clearing leaves the keys of other services sharing the database'''
+
+        self.redis.data[b'other-service:key'] = (b'value', None)
+        Cache('test', 'date_ttl').set_many(dict((index, index) for index in range(1500)))
+
+        get_backend().clear()
+
+        self.assertEqual(list(self.redis.data), [b'other-service:key'])
+
+    def test_memory_bytes(self):
+        '''the memory backend is bounded by the size of its values, too big ones aren't kept'''
+
+        # every value takes 12 bytes as json, 32 for c
+        backend = MemoryBackend(max_size=100, max_bytes=40, max_entry_bytes=20)
+        backend.set('a', 'x' * 10, 30)
+        backend.set_many({'b': 'x' * 10, 'c': 'x' * 30}, 60)
+        backend.set('d', 'x' * 10, 120)
+        backend.set('e', 'x' * 10, 120)
+
+        self.assertEqual(backend._bytes, 36)
+        self.assertEqual(sorted(backend.get_many(['a', 'b', 'c', 'd', 'e'])), ['b', 'd', 'e'])
+
+    def test_redis_unavailable(self):
+        '''an unreachable redis is a cache miss, not an error'''
+
+        self.redis.stop()
+        self.assertIsNone(Cache('test', 'date_ttl').get('missing'))
+
+
+class GadmAreaServiceTest(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp()
+        os.close(handle)
+        GadmAreaService.write(self.path, [('PER', None, None, 1000.5), ('PER', 1, None, 200.0), ('PER', 1, 2, 50.0),
+                                          ('BRA', 3, None, 75.0)])
+        GadmAreaService.load(self.path)
+
+    def tearDown(self):
+        GadmAreaService._map = None
+        os.remove(self.path)
+
+    def test_lookup(self):
+        '''areas of known units come from the table, unknown units return None'''
+
+        self.assertEqual(GadmAreaService.lookup('per'), 1000.5)
+        self.assertEqual(GadmAreaService.lookup('PER', '1', '2'), 50.0)
+        self.assertEqual(GadmAreaService.lookup('BRA', 3), 75.0)
+        self.assertIsNone(GadmAreaService.lookup('BRA', 4))
+        self.assertIsNone(GadmAreaService.lookup('BRA', 'abc'))
+
+    def test_gadm_request_uses_table(self):
+        '''known units don't need a geostore request'''
+
+        self.assertEqual(GeostoreService.make_gadm_request('PER', '1'), 200.0)
+
+
+class QueryConstructorServiceTest(unittest.TestCase):
+
+    def test_since_sql(self):
+        '''since mode only scans alerts after the last seen date'''
+
+        sql = QueryConstructorService.format_terrai_sql('2020', '100', None, None, iso='BRA', agg_values=True,
+                                                        since=True)[0]
+
+        self.assertIn("WHERE ((year = 2020 and day > 100) or (year > 2020)) AND (country_iso = 'BRA')", sql)
+        self.assertTrue(sql.endswith('GROUP BY year, day'))
+
+
+DAILY_COUNTS = {"data": [{"year": 2017, "day": 1, "COUNT(*)": 3},
+                         {"year": 2017, "day": 5, "COUNT(*)": 2},
+                         {"year": 2018, "day": 2, "COUNT(*)": 4}]}
+
+
+class ResponseServiceTest(unittest.TestCase):
+
+    def test_columnar_format(self):
+        '''aggregated rows are returned as parallel arrays with delta encoded dates'''
+
+        rows = SummaryService.create_time_table('terrai', DAILY_COUNTS, 'day')
+        table = ResponseService.to_columnar(rows, delta_dates=True)
+
+        self.assertEqual(table['columns'], ['year', 'alert_date', 'julian_day', 'count'])
+        self.assertEqual(table['count'], [3, 2, 4])
+        self.assertEqual(table['alert_date'], {'start': '2017-01-01', 'deltas': [4, 362]})
+
+    def test_requested_format(self):
+        '''the format parameter takes precedence over the Accept header'''
+
+        self.assertEqual(ResponseService.requested_format({}, 'application/vnd.columnar+json'), 'columnar')
+        self.assertEqual(ResponseService.requested_format({'format': 'json'}, 'application/vnd.columnar+json'), 'json')
+        self.assertEqual(ResponseService.requested_format({}), 'json')
+
+
+class SeriesServiceTest(unittest.TestCase):
+
+    def test_period_totals(self):
+        '''period totals and rows are read from the cumulative series'''
+
+        series = SeriesService.extend({'days': [], 'cumsum': []}, DAILY_COUNTS['data'])
+
+        self.assertEqual(series['cumsum'], [3, 5, 9])
+        self.assertEqual(SeriesService.total(series, '2004-01-01,2018-12-31'), 9)
+        self.assertEqual(SeriesService.total(series, '2017-01-02,2018-01-02'), 6)
+        self.assertEqual(SeriesService.total(series, '2017-01-06,2018-01-01'), 0)
+        self.assertEqual(SeriesService.rows(series, '2017-01-05,2018-12-31'),
+                         [{'year': 2017, 'day': 5, 'COUNT(*)': 2}, {'year': 2018, 'day': 2, 'COUNT(*)': 4}])
+
+    def test_extend_appends_new_days(self):
+        '''only days after the last cached day are added'''
+
+        series = SeriesService.extend({'days': [], 'cumsum': []}, DAILY_COUNTS['data'])
+        series = SeriesService.extend(series, [{'year': 2018, 'day': 2, 'COUNT(*)': 4},
+                                               {'year': 2018, 'day': 10, 'COUNT(*)': 1}])
+
+        self.assertEqual(series['cumsum'], [3, 5, 9, 10])
+        self.assertEqual(SeriesService.total(series, '2018-01-03,2018-12-31'), 1)
+
+
+# (lat, long, year, day), the last one outside of POLYGON
+ALERTS = [(-9.9, -59.9, 2017, 10), (-9.4, -59.6, 2017, 20), (-9.4, -59.2, 2018, 5), (-9.5, -58.5, 2017, 10)]
+
+
+class SummaryServiceTest(unittest.TestCase):
+
+    def test_rolling_and_cumulative(self):
+        '''rolling sums include the days before the period, cumulative totals only the days with alerts'''
+
+        self.assertEqual(SummaryService.statistics_period('rolling', '2017-01-03,2017-01-06', 3), '2017-01-01,2017-01-06')
+
+        rows = SummaryService.create_statistics('terrai', DAILY_COUNTS, 'rolling', '2017-01-03,2017-01-06', 3)
+        self.assertEqual([row['alert_date'] for row in rows], ['2017-01-03', '2017-01-04', '2017-01-05', '2017-01-06'])
+        self.assertEqual([row['rolling_count'] for row in rows], [3, 0, 2, 2])
+
+        rows = SummaryService.create_statistics('terrai', DAILY_COUNTS, 'cumulative', '2017-01-02,2018-12-31')
+        self.assertEqual(rows, [{'alert_date': '2017-01-05', 'count': 2, 'cumulative_count': 2},
+                                {'alert_date': '2018-01-02', 'count': 4, 'cumulative_count': 6}])
+
+    def test_year_over_year(self):
+        '''every month of the period is compared to the same days of the previous year'''
+
+        self.assertEqual(SummaryService.statistics_period('yoy', '2018-01-01,2018-02-15'), '2017-01-01,2018-02-15')
+
+        rows = SummaryService.create_statistics('terrai', DAILY_COUNTS, 'yoy', '2018-01-01,2018-02-15')
+        self.assertEqual(rows, [{'year': 2018, 'month': 1, 'count': 4, 'previous_count': 5, 'change': -0.2},
+                                {'year': 2018, 'month': 2, 'count': 0, 'previous_count': 0, 'change': None}])
+
+
+class TileServiceTest(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp()
+        os.close(handle)
+        os.remove(self.path)
+        TileService.build(self.path, ALERTS, max_zoom=1)
+        settings['tiles']['path'] = self.path
+
+    def tearDown(self):
+        settings['tiles']['path'] = None
+        os.remove(self.path)
+
+    def test_covered_tiles(self):
+        '''alerts of tiles fully inside the geometry are counted exactly'''
+
+        self.assertEqual(TileService.estimate(POLYGON, datetime.date(2017, 1, 1), datetime.date(2018, 12, 31)), (3, 0))
+        self.assertEqual(TileService.estimate(POLYGON, datetime.date(2017, 1, 15), datetime.date(2017, 12, 31)), (1, 0))
+
+    def test_partial_tiles(self):
+        '''partially covered tiles are weighted by their covered share and widen the error bound'''
+
+        strip = {"type": "Polygon",
+                 "coordinates": [[[-60.0, -10.0], [-59.75, -10.0], [-59.75, -9.0], [-60.0, -9.0], [-60.0, -10.0]]]}
+
+        self.assertEqual(TileService.estimate(strip, datetime.date(2017, 1, 1), datetime.date(2018, 12, 31)), (1, 1))
+
+
+class UpstreamTest(unittest.TestCase):
+
+    def setUp(self):
+        create_application()
+        metrics.reset()
+        self.calls = []
+
+    def slow_first_mock(self):
+
+        @urlmatch(path=r'.*/query.*')
+        def query_mock(url, request):
+            self.calls.append(url)
+            if len(self.calls) == 1:
+                time.sleep(0.5)
+            return response(200, {"data": [{"count": len(self.calls)}]}, {'content-type': 'application/json'}, None, 5,
+                            request)
+
+        return query_mock
+
+    def test_hedged_request(self):
+        '''a slow read-only call is duplicated and the faster answer is used'''
+
+        logging.info('[TEST]: Beginning hedged request test')
+        for _ in range(settings['hedging']['min_samples']):
+            upstream._record('hedge-test', 0.01, False)
+
+        settings['hedging']['enabled'] = True
+        try:
+            with HTTMock(self.slow_first_mock()):
+                data = upstream.request_upstream('hedge-test', {'uri': '/query/test', 'method': 'GET'}, hedge=True)
+        finally:
+            settings['hedging']['enabled'] = False
+
+        self.assertEqual(data['data'][0]['count'], 2)
+        counters = metrics.snapshot()['counters']
+        self.assertEqual(counters['upstream.hedge-test.hedges'], 1)
+        self.assertEqual(counters['upstream.hedge-test.hedges_won'], 1)
+
+    def test_circuit_breaker(self):
+        '''failing calls open the circuit, a successful probe closes it again'''
+
+        logging.info('[TEST]: Beginning circuit breaker test')
+
+        @urlmatch(path=r'.*/query.*')
+        def failing_mock(url, request):
+            self.calls.append(url)
+            return response(500, {"errors": [{"status": 500, "detail": "down"}]}, {'content-type': 'application/json'},
+                            None, 5, request)
+
+        config = {'uri': '/query/test', 'method': 'GET'}
+        min_calls = settings['circuit_breaker']['min_calls']
+        open_seconds = settings['circuit_breaker']['open_seconds']
+        try:
+            with HTTMock(failing_mock):
+                for _ in range(min_calls):
+                    upstream.request_upstream('breaker-test', config)
+                self.assertRaises(UpstreamUnavailable, upstream.request_upstream, 'breaker-test', config)
+
+            self.assertEqual(len(self.calls), min_calls)
+            settings['circuit_breaker']['open_seconds'] = 0
+            with HTTMock(self.slow_first_mock()):
+                upstream.request_upstream('breaker-test', config)
+        finally:
+            settings['circuit_breaker']['open_seconds'] = open_seconds
+
+        self.assertEqual(circuit_breaker.get_breaker('breaker-test').state, circuit_breaker.CLOSED)
+        circuit_breaker.reset()
+
+    def test_circuit_breaker_timeouts(self):
+        '''hanging upstreams open the circuit, calls cut short by a client's short deadline don't'''
+
+        logging.info('[TEST]: Beginning circuit breaker timeout test')
+        config = {'uri': '/query/test', 'method': 'GET'}
+        app = create_application()
+        min_calls = settings['circuit_breaker']['min_calls']
+
+        @urlmatch(path=r'.*/query.*')
+        def timeout_mock(url, request):
+            raise requests.exceptions.ReadTimeout()
+
+        with HTTMock(timeout_mock):
+            with app.test_request_context('/api/v2/ms/terrai-alerts', headers={'x-request-deadline': '1'}):
+                deadline.start_request()
+                for _ in range(min_calls):
+                    self.assertRaises(DeadlineExceeded, upstream.request_upstream, 'client-deadline-test', config)
+            self.assertEqual(circuit_breaker.get_breaker('client-deadline-test').state, circuit_breaker.CLOSED)
+
+            with app.test_request_context('/api/v2/ms/terrai-alerts'):
+                deadline.start_request()
+                for _ in range(min_calls):
+                    self.assertRaises(DeadlineExceeded, upstream.request_upstream, 'timeout-test', config)
+                self.assertRaises(UpstreamUnavailable, upstream.request_upstream, 'timeout-test', config)
+
+        with app.app_context():
+            # a spent deadline fails before the breaker lets a probe through
+            breaker = circuit_breaker.get_breaker('timeout-test')
+            breaker.opened_at = 0
+            g.deadline = time.time() - 1
+            self.assertRaises(DeadlineExceeded, upstream.request_upstream, 'timeout-test', config)
+            self.assertEqual(breaker.state, circuit_breaker.OPEN)
+
+            g.deadline = None
+            with HTTMock(self.slow_first_mock()):
+                upstream.request_upstream('timeout-test', config)
+            self.assertEqual(breaker.state, circuit_breaker.CLOSED)
+
+        circuit_breaker.reset()
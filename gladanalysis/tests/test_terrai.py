@@ -1,11 +1,20 @@
 import json
 import logging
 import os
+import tempfile
+import time
 import unittest
+import zlib
 
+from flask import g
 from httmock import urlmatch, response, HTTMock
 
 from gladanalysis import create_application
+from gladanalysis.config import settings
+from gladanalysis.services import TileService
+from gladanalysis.utils import admission, circuit_breaker, deadline, jobs, metrics
+from gladanalysis.tests.redis_stub import RedisStub
+from gladanalysis.utils.cache import get_backend, reset_backend
 
 
 @urlmatch(path=r'.*/geostore.*')
@@ -27,6 +36,19 @@ def query_mock(url, request):
     return response(200, content, headers, None, 5, request)
 
 
+@urlmatch(path=r'.*/query.*', query=r'.*GROUP.*')
+def drilldown_mock(url, request):
+    headers = {'content-type': 'application/json'}
+    content = {"data": [{"state_id": 1, "COUNT(day)": 5}, {"state_id": 2, "COUNT(day)": 9}]}
+    return response(200, content, headers, None, 5, request)
+
+
+@urlmatch(path=r'.*/geostore.*')
+def slow_geostore_mock(url, request):
+    time.sleep(0.3)
+    return geostore_mock(url, request)
+
+
 class TerraiTest(unittest.TestCase):
 
     def setUp(self):
@@ -35,6 +57,7 @@ class TerraiTest(unittest.TestCase):
         app.config['TESTING'] = True
         app.config['DEBUG'] = False
         self.app = app.test_client()
+        get_backend().clear()
 
     def tearDown(self):
         pass
@@ -138,6 +161,10 @@ class TerraiTest(unittest.TestCase):
 
             self.assertions(data, status_code, 200, 'type', 'terrai-alerts')
 
+        for path in ['per/abc', 'per/1/abc', 'per/1/2.5']:
+            data, status_code = self.make_request('/api/v2/ms/terrai-alerts/admin/' + path)
+            self.assertEqual(status_code, 400)
+
     def test_use_and_periods(self):
         '''test request land use and terrai periods'''
 
@@ -161,3 +188,378 @@ class TerraiTest(unittest.TestCase):
             logging.info('[TEST]: response deserialized: {}'.format(data))
 
             self.assertions(data, status_code, 200, 'type', 'terrai-alerts')
+
+    def test_deadline_exceeded(self):
+        '''a request whose deadline is spent by a slow upstream fails fast with a 504'''
+
+        logging.info('[TEST]: Beginning terrai deadline Test')
+        with HTTMock(query_mock):
+            with HTTMock(slow_geostore_mock):
+                response = self.app.get('/api/v2/ms/terrai-alerts?geostore=beb8e2f26bd26406fcf2018d343a62c5',
+                                        headers={'x-request-deadline': '0.1'})
+
+        self.assertEqual(response.status_code, 504)
+        self.assertEqual(json.loads(response.data)['errors'][0]['detail'], 'Request deadline exceeded')
+
+        # the header can't switch the deadline off
+        for header in ['0', '-1', 'nan', 'inf']:
+            with self.app.application.test_request_context('/api/v2/ms/terrai-alerts',
+                                                           headers={'x-request-deadline': header}):
+                deadline.start_request()
+                self.assertAlmostEqual(g.deadline - time.time(), settings['deadline']['default'], places=0)
+
+    def test_conditional_get(self):
+        '''a request repeating the ETag of the previous response gets a 304'''
+
+        logging.info('[TEST]: Beginning terrai conditional GET Test')
+        url = '/api/v2/ms/terrai-alerts?geostore=beb8e2f26bd26406fcf2018d343a62c5&period=2017-01-01,2017-12-30'
+        with HTTMock(query_mock):
+            with HTTMock(geostore_mock):
+                response = self.app.get(url)
+                etag = response.headers.get('ETag')
+                not_modified = self.app.get(url, headers={'If-None-Match': etag})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers.get('Cache-Control'), 'public, max-age=300')
+        self.assertTrue(etag.startswith('W/'))
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.headers.get('ETag'), etag)
+
+    def test_gzip_response(self):
+        '''responses are gzipped when the client accepts it'''
+
+        logging.info('[TEST]: Beginning terrai compression Test')
+        min_size = settings['compression']['min_size']
+        settings['compression']['min_size'] = 0
+        try:
+            with HTTMock(query_mock):
+                with HTTMock(geostore_mock):
+                    response = self.app.get('/api/v2/ms/terrai-alerts/wdpa/100?period=2017-01-01,2017-12-30',
+                                            headers={'Accept-Encoding': 'gzip'})
+        finally:
+            settings['compression']['min_size'] = min_size
+
+        self.assertEqual(response.headers.get('Content-Encoding'), 'gzip')
+        data = json.loads(zlib.decompress(response.data, 16 + zlib.MAX_WBITS)).get('data')
+        self.assertEqual(data.get('type'), 'terrai-alerts')
+        self.assertIn('compression.gzip.cpu_seconds', metrics.snapshot()['timings'])
+
+    def test_since(self):
+        '''since mode returns the latest date, with nothing new when polling after it'''
+
+        logging.info('[TEST]: Beginning terrai since Test')
+        data, status_code = self.make_request('/api/v2/ms/terrai-alerts/wdpa/100?since=2017-01-01')
+
+        self.assertEqual(status_code, 200)
+        self.assertEqual(data.get('since'), '2017-01-01')
+        self.assertEqual(data['attributes']['latestDate'], '0123-05-03')
+        self.assertEqual(data['attributes']['value'], 0)
+
+        data, status_code = self.make_request(
+            '/api/v2/ms/terrai-alerts/wdpa/100?since=2017-01-01&period=2017-01-01,2017-02-01')
+        self.assertEqual(status_code, 400)
+
+    def test_drilldown(self):
+        '''counts of every state of a country are returned from one grouped query'''
+
+        logging.info('[TEST]: Beginning terrai drill-down Test')
+        with HTTMock(query_mock):
+            with HTTMock(drilldown_mock):
+                response = self.app.get('/api/v2/ms/terrai-alerts/drilldown/BRA?period=2017-01-01,2017-12-30')
+        data = json.loads(response.data).get('data')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['attributes']['level'], 'adm1')
+        self.assertEqual(data['attributes']['value'], [{'id': 2, 'count': 9}, {'id': 1, 'count': 5}])
+
+    def test_rolling_statistics(self):
+        '''rolling sums are computed from a query starting window - 1 days before the period'''
+
+        queries = []
+
+        @urlmatch(path=r'.*/query.*')
+        def daily_mock(url, request):
+            # posted geometries send the sql in the body
+            sql = url.query if request.method == 'GET' else json.loads(request.body).get('sql', '')
+            if 'GROUP' not in sql:
+                return None
+            queries.append(sql)
+            return response(200, {"data": [{"year": 2017, "day": 1, "COUNT(*)": 3}]},
+                            {'content-type': 'application/json'}, None, 5, request)
+
+        with HTTMock(query_mock, geostore_mock):
+            with HTTMock(daily_mock):
+                result = self.app.get('/api/v2/ms/terrai-alerts?geostore=test&aggregate_values=true'
+                                      '&aggregate_by=rolling&window=3&period=2017-01-02,2017-01-04')
+                # posted geometries take the aggregation from the query string too
+                polygon = {"type": "Polygon", "coordinates": [[[-60.0, -10.0], [-59.0, -10.0], [-59.0, -9.0],
+                                                               [-60.0, -9.0], [-60.0, -10.0]]]}
+                posted = self.app.post('/api/v2/ms/terrai-alerts?aggregate_values=true&aggregate_by=rolling'
+                                       '&window=14&period=2017-01-02,2017-01-04',
+                                       data=json.dumps({'geojson': {"type": "FeatureCollection", "features": [
+                                           {"type": "Feature", "properties": {}, "geometry": polygon}]}}),
+                                       content_type='application/json')
+        data = json.loads(result.data).get('data')
+
+        self.assertEqual(posted.status_code, 200)
+        self.assertEqual(json.loads(posted.data)['data']['window'], 14)
+
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(data['window'], 3)
+        self.assertEqual(data['period'], '2017-01-02,2017-01-04')
+        self.assertEqual([row['rolling_count'] for row in data['attributes']['value']], [3, 3, 0])
+        self.assertIn('year%20=%202016%20and%20day%20%3E=%20366', queries[0])
+
+        data, status_code = self.make_request('/api/v2/ms/terrai-alerts?geostore=test&aggregate_values=true'
+                                              '&aggregate_by=month&window=3')
+        self.assertEqual(status_code, 400)
+
+        # routes without a geostore parameter validate them as well
+        for query in ['window=abc', 'since=2017-01-01&aggregate_values=true&aggregate_by=rolling']:
+            data, status_code = self.make_request('/api/v2/ms/terrai-alerts/wdpa/100?' + query)
+            self.assertEqual(status_code, 400)
+
+    def test_admission_control(self):
+        '''a saturated route class is rejected with a 503 while cheap routes keep answering'''
+
+        logging.info('[TEST]: Beginning terrai admission control Test')
+        route_class = admission.get_class('analysis')
+        queue_timeout = settings['admission']['queue_timeout']
+        settings['admission']['queue_timeout'] = 0.05
+        taken = 0
+        try:
+            while route_class.acquire(0):
+                taken += 1
+
+            with HTTMock(query_mock):
+                with HTTMock(geostore_mock):
+                    response = self.app.get('/api/v2/ms/terrai-alerts?geostore=beb8e2f26bd26406fcf2018d343a62c5')
+                    latest = self.app.get('/api/v2/ms/terrai-alerts/latest')
+        finally:
+            settings['admission']['queue_timeout'] = queue_timeout
+            for _ in range(taken):
+                route_class.release()
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers.get('Retry-After'), '1')
+        self.assertEqual(latest.status_code, 200)
+        self.assertEqual(route_class.active, 0)
+
+    def test_feature_breakdown(self):
+        '''every feature of a posted FeatureCollection is analyzed along with the whole collection'''
+
+        logging.info('[TEST]: Beginning terrai feature breakdown Test')
+        polygon = {"type": "Polygon",
+                   "coordinates": [[[-60.0, -10.0], [-59.0, -10.0], [-59.0, -9.0], [-60.0, -9.0], [-60.0, -10.0]]]}
+        geojson = {"type": "FeatureCollection",
+                   "features": [{"type": "Feature", "id": "a", "properties": {}, "geometry": polygon},
+                                {"type": "Feature", "properties": {}, "geometry": polygon}]}
+
+        with HTTMock(query_mock):
+            response = self.app.post('/api/v2/ms/terrai-alerts?breakdown=features&period=2017-01-01,2017-12-30',
+                                     data=json.dumps({'geojson': geojson}), content_type='application/json')
+            invalid = self.app.post('/api/v2/ms/terrai-alerts?breakdown=features',
+                                    data=json.dumps({'geojson': geojson['features'][0]}),
+                                    content_type='application/json')
+            # the feature without id is keyed by its position
+            geojson['features'][0]['id'] = 1
+            duplicate = self.app.post('/api/v2/ms/terrai-alerts?breakdown=features',
+                                      data=json.dumps({'geojson': geojson}), content_type='application/json')
+        data = json.loads(response.data).get('data')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['attributes']['value'], 123)
+        self.assertEqual(sorted(data['attributes']['features']), ['1', 'a'])
+        self.assertEqual(data['attributes']['features']['a']['value'], 123)
+        self.assertAlmostEqual(data['attributes']['areaHa'], 2 * data['attributes']['features']['1']['areaHa'])
+        self.assertEqual(invalid.status_code, 400)
+        self.assertEqual(duplicate.status_code, 400)
+
+    def test_combined(self):
+        '''every configured dataset is analyzed after a single geostore lookup'''
+
+        logging.info('[TEST]: Beginning combined datasets Test')
+        lookups = []
+
+        @urlmatch(path=r'.*/geostore.*')
+        def counting_geostore_mock(url, request):
+            lookups.append(url)
+            return geostore_mock(url, request)
+
+        url = '/api/v2/ms/terrai-alerts/combined?geostore=beb8e2f26bd26406fcf2018d343a62c5'
+        glad = settings['datasets']['glad']
+        settings['datasets']['glad'] = dict(glad, dataset_id='glad-dataset', index_id='index_glad')
+        try:
+            with HTTMock(query_mock):
+                with HTTMock(counting_geostore_mock):
+                    response = self.app.get(url + '&period=2017-01-01,2017-12-30')
+                    unknown = self.app.get(url + '&datasets=viirs')
+        finally:
+            settings['datasets']['glad'] = glad
+
+        data = json.loads(response.data).get('data')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['type'] for result in data], ['glad-alerts', 'terrai-alerts'])
+        self.assertEqual(data[0]['id'], 'glad-dataset')
+        self.assertIn('julian_day', data[0]['attributes']['downloadUrls']['csv'])
+        self.assertEqual(len(lookups), 1)
+        self.assertEqual(unknown.status_code, 400)
+
+    def test_approximate(self):
+        '''approximate mode answers from the tile pyramid with an error bound'''
+
+        logging.info('[TEST]: Beginning terrai approximate Test')
+        polygon = {"type": "Polygon",
+                   "coordinates": [[[-60.0, -10.0], [-59.0, -10.0], [-59.0, -9.0], [-60.0, -9.0], [-60.0, -10.0]]]}
+        geojson = {"type": "FeatureCollection", "features": [{"type": "Feature", "properties": {}, "geometry": polygon}]}
+        url = '/api/v2/ms/terrai-alerts?mode=approximate&period=2017-01-01,2017-12-30'
+
+        unavailable = self.app.post(url, data=json.dumps({'geojson': geojson}), content_type='application/json')
+
+        handle, path = tempfile.mkstemp()
+        os.close(handle)
+        os.remove(path)
+        TileService.build(path, [(-9.5, -59.5, 2017, 10), (-9.5, -59.5, 2017, 11)], max_zoom=2)
+        settings['tiles']['path'] = path
+        try:
+            response = self.app.post(url, data=json.dumps({'geojson': geojson}), content_type='application/json')
+        finally:
+            settings['tiles']['path'] = None
+            os.remove(path)
+        data = json.loads(response.data).get('data')
+
+        self.assertEqual(unavailable.status_code, 400)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['mode'], 'approximate')
+        self.assertEqual(data['attributes']['value'], 2)
+        self.assertEqual(data['attributes']['errorBound'], 0)
+
+    def test_serve_stale(self):
+        '''while the upstream circuits are open the last known good results are served, marked stale'''
+
+        logging.info('[TEST]: Beginning terrai serve stale Test')
+        url = '/api/v2/ms/terrai-alerts?geostore=beb8e2f26bd26406fcf2018d343a62c5&period=2017-01-01,2017-12-30'
+        with HTTMock(query_mock):
+            with HTTMock(geostore_mock):
+                fresh = self.app.get(url)
+
+        # expire the fresh entries, keeping the last known good ones
+        backend = get_backend()
+        for key in [key for key in backend._data if '-stale:' not in key]:
+            del backend._data[key]
+
+        circuit_breaker.get_breaker('query')._open()
+        circuit_breaker.get_breaker('geostore')._open()
+        try:
+            stale = self.app.get(url)
+            jobs.run(self.app.application, 'stale', {
+                'endpoint': 'endpoints.query_terrai', 'view_args': {}, 'method': 'GET',
+                'path': '/api/v2/ms/terrai-alerts', 'query_string': url.split('?')[1], 'body': '',
+                'content_type': None, 'accept': None})
+        finally:
+            circuit_breaker.reset()
+
+        self.assertEqual(stale.status_code, 200)
+        self.assertEqual(stale.headers.get('Warning'), '110 - "Response is Stale"')
+        self.assertEqual(json.loads(stale.data), json.loads(fresh.data))
+        # jobs flag their stale results
+        self.assertEqual(jobs.get('stale')['status'], 'done')
+        self.assertTrue(jobs.get('stale')['stale'])
+
+    def test_async_job(self):
+        '''an analysis sent with async=true is answered with a job whose result can be polled'''
+
+        logging.info('[TEST]: Beginning terrai async job Test')
+        url = '/api/v2/ms/terrai-alerts?geostore=beb8e2f26bd26406fcf2018d343a62c5&period=2017-01-01,2017-12-30&async=true'
+
+        # refused while jobs would only be known by the worker that queued them
+        self.assertEqual(self.app.get(url).status_code, 400)
+
+        redis = RedisStub()
+        redis.start()
+        cache_settings = dict(settings['cache'])
+        settings['cache'].update({'backend': 'redis', 'redis_url': redis.url})
+        reset_backend()
+        try:
+            with HTTMock(query_mock):
+                with HTTMock(geostore_mock):
+                    submitted = self.app.get(url)
+                    job_id = json.loads(submitted.data)['data']['id']
+
+                    for _ in range(50):
+                        job = json.loads(self.app.get('/api/v2/ms/terrai-alerts/jobs/' + job_id).data).get('data')
+                        if job['attributes']['status'] in ('done', 'failed'):
+                            break
+                        time.sleep(0.05)
+
+            # jobs of a recycled worker are never finished, they fail once older than jobs.timeout
+            long_ago = time.time() - settings['jobs']['timeout'] - 1
+            jobs._jobs.set('queued', {'status': 'queued', 'submitted': long_ago})
+            jobs._jobs.set('running', {'status': 'running', 'submitted': long_ago, 'started': long_ago})
+            interrupted = [jobs.get('queued'), jobs.get('running')]
+        finally:
+            settings['cache'] = cache_settings
+            reset_backend()
+            redis.stop()
+
+        self.assertEqual(submitted.status_code, 202)
+        self.assertEqual(submitted.headers.get('Location'), '/v1/terrai-alerts/jobs/' + job_id)
+        self.assertEqual(job['attributes']['status'], 'done')
+        self.assertEqual(job['attributes']['result']['data']['attributes']['value'], 123)
+        self.assertNotIn('stale', job['attributes'])
+        self.assertEqual([state['status'] for state in interrupted], ['failed', 'failed'])
+        self.assertEqual([state['code'] for state in interrupted], [504, 504])
+        self.assertEqual(self.app.get('/api/v2/ms/terrai-alerts/jobs/unknown').status_code, 404)
+
+    def test_geostore_registration(self):
+        '''a posted geometry is registered once and queried by geostore id'''
+
+        logging.info('[TEST]: Beginning terrai geostore registration Test')
+        registrations, queries = [], []
+
+        @urlmatch(path=r'.*/geostore$', method='POST')
+        def register_mock(url, request):
+            registrations.append(url)
+            return geostore_mock(url, request)
+
+        @urlmatch(path=r'.*/query.*')
+        def recording_query_mock(url, request):
+            queries.append((request.method, url.query))
+            return query_mock(url, request)
+
+        polygon = {"type": "Polygon",
+                   "coordinates": [[[-60.0, -10.0], [-59.0, -10.0], [-59.0, -9.0], [-60.0, -9.0], [-60.0, -10.0]]]}
+        body = json.dumps({'geojson': {"type": "FeatureCollection",
+                                       "features": [{"type": "Feature", "properties": {}, "geometry": polygon}]}})
+
+        # id of the geostore created by geostore_mock
+        geostore_id = '1dca5597-d6ac-4064-82cf-9f02b178f424'
+
+        settings['geostore_registration']['enabled'] = True
+        try:
+            with HTTMock(register_mock, recording_query_mock):
+                # while the geostore circuit is open the geometry is sent with the queries
+                circuit_breaker.get_breaker('geostore')._open()
+                inline = self.app.post('/api/v2/ms/terrai-alerts?period=2017-01-01,2017-12-30',
+                                       data=body, content_type='application/json')
+                circuit_breaker.reset()
+                inline_methods = set(method for method, query in queries)
+                del queries[:]
+
+                responses = [self.app.post('/api/v2/ms/terrai-alerts?period=2017-01-0{},2017-12-30'.format(day),
+                                           data=body, content_type='application/json') for day in (1, 2)]
+        finally:
+            settings['geostore_registration']['enabled'] = False
+            circuit_breaker.reset()
+
+        data = json.loads(responses[1].data).get('data')
+
+        self.assertEqual(inline.status_code, 200)
+        self.assertEqual(inline_methods, set(['POST']))
+        self.assertEqual(len(registrations), 1)
+        self.assertEqual(data['geostore'], geostore_id)
+        self.assertEqual(data['attributes']['value'], 123)
+        self.assertTrue([query for method, query in queries if 'count' in query])
+        self.assertTrue(all(method == 'GET' and 'geostore=' + geostore_id in query
+                            for method, query in queries if 'count' in query))
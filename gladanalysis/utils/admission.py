@@ -0,0 +1,114 @@
+"""Admission control per route class
+
+Requests are grouped in classes (cheap date lookups, analyses, POSTed geometries)
+that each get a number of concurrent slots and a bounded queue. A request that
+finds its class full waits in the queue for a short while; once the queue is full
+too it is rejected right away with a 503 and Retry-After, so a burst of expensive
+requests can't starve the cheap ones sharing the same gevent workers."""
+
+import threading
+import time
+
+from flask import g, request
+
+from gladanalysis.config import settings
+from gladanalysis.errors import ServiceOverloaded
+from gladanalysis.utils import deadline, metrics
+
+
+class RouteClass(object):
+    """Concurrency limit with a bounded number of waiting requests"""
+
+    def __init__(self, limit, queue):
+        self.limit = limit
+        self.queue = queue
+        self.active = 0
+        self.waiting = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, timeout):
+        """take a slot, waiting at most timeout seconds; False if the class is saturated"""
+
+        with self._condition:
+            if self.active < self.limit:
+                self.active += 1
+                return True
+
+            if self.waiting >= self.queue or not timeout:
+                return False
+
+            self.waiting += 1
+            end = time.time() + timeout
+            try:
+                while self.active >= self.limit:
+                    left = end - time.time()
+                    if left <= 0:
+                        return False
+                    self._condition.wait(left)
+
+                self.active += 1
+                return True
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+
+_classes = {}
+_lock = threading.Lock()
+
+
+def get_class(name):
+    with _lock:
+        if name not in _classes:
+            config = settings.get('admission', {}).get('classes', {}).get(name, {})
+            _classes[name] = RouteClass(config.get('limit', 1), config.get('queue', 0))
+
+        return _classes[name]
+
+
+def route_class():
+    """class of the current request, None for requests not subject to admission control"""
+    config = settings.get('admission', {})
+
+    # admin routes must stay reachable when the service is overloaded
+    if not request.endpoint or not request.endpoint.startswith('endpoints.') or \
+            request.endpoint.startswith('endpoints.admin_'):
+        return None
+
+    # POSTed geometries are the most expensive requests whatever the route
+    if request.method == 'POST':
+        return 'geometry'
+
+    return config.get('routes', {}).get(request.endpoint, config.get('default'))
+
+
+def admit():
+    """before_request hook taking a slot of the request's class, registered after the deadline hook"""
+    config = settings.get('admission', {})
+    if not config.get('enabled'):
+        return
+
+    name = route_class()
+    if name is None:
+        return
+
+    started = time.time()
+    if not get_class(name).acquire(deadline.remaining(config.get('queue_timeout'))):
+        metrics.incr('admission.{}.rejected'.format(name))
+        raise ServiceOverloaded(message='Too many {} requests, retry later'.format(name))
+
+    g.admission_class = name
+    metrics.observe('admission.{}.wait'.format(name), time.time() - started)
+
+
+def release(exception=None):
+    """teardown_request hook giving the slot back"""
+    name = getattr(g, 'admission_class', None)
+
+    if name is not None:
+        get_class(name).release()
+        g.admission_class = None
@@ -0,0 +1,236 @@
+"""Cache backends
+
+Date, geostore and analysis results are cached through Cache objects, which hash their
+keys and store values in the configured backend: an in-process memory backend, or a
+redis backend shared by every worker and pod (CACHE_BACKEND=redis, REDIS_URL)."""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+
+from gladanalysis.config import settings
+from gladanalysis.utils import metrics
+
+# values bigger than this are stored zlib compressed by the redis backend
+COMPRESS_MIN_SIZE = 512
+
+
+class MemoryBackend(object):
+    """Thread safe dict whose entries expire after their ttl
+    Values are stored as is, callers must not mutate what they get back. Besides the
+    number of entries, their total size (as compact json) is bounded by max_bytes, and
+    values bigger than max_entry_bytes aren't kept at all."""
+
+    def __init__(self, max_size=4096, max_bytes=None, max_entry_bytes=None):
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self._lock = threading.Lock()
+        self._data = {}
+        self._bytes = 0
+
+    @staticmethod
+    def sizeof(value):
+        return len(json.dumps(value, separators=(',', ':')))
+
+    def _drop(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        now = time.time()
+        found = {}
+
+        with self._lock:
+            for key in keys:
+                entry = self._data.get(key)
+                if entry is None:
+                    continue
+
+                if entry[0] < now:
+                    self._drop(key)
+                else:
+                    found[key] = entry[1]
+
+        return found
+
+    def set(self, key, value, ttl):
+        self.set_many({key: value}, ttl)
+
+    def set_many(self, mapping, ttl):
+        bounded = self.max_bytes or self.max_entry_bytes
+        sizes = dict((key, MemoryBackend.sizeof(value) if bounded else 0) for key, value in mapping.items())
+
+        with self._lock:
+            for key, value in mapping.items():
+                self._drop(key)
+
+                size = sizes[key]
+                if (self.max_entry_bytes and size > self.max_entry_bytes) or (self.max_bytes and size > self.max_bytes):
+                    continue
+
+                while self._data and (len(self._data) >= self.max_size or
+                                      (self.max_bytes and self._bytes + size > self.max_bytes)):
+                    # drop the entry closest to expiry
+                    self._drop(min(self._data, key=lambda k: self._data[k][0]))
+
+                self._data[key] = (time.time() + ttl, value, size)
+                self._bytes += size
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+
+class RedisBackend(object):
+    """Backend shared across workers and pods, values are serialized as compact (compressed) json
+    Errors are logged and treated as misses so an unavailable redis never fails a request."""
+
+    def __init__(self, url, prefix=''):
+        import redis
+
+        self.client = redis.StrictRedis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self.prefix = prefix
+
+    @staticmethod
+    def dumps(value):
+        data = json.dumps(value, separators=(',', ':')).encode('utf-8')
+        if len(data) >= COMPRESS_MIN_SIZE:
+            return b'z' + zlib.compress(data)
+        return b'j' + data
+
+    @staticmethod
+    def loads(data):
+        if data[:1] == b'z':
+            return json.loads(zlib.decompress(data[1:]).decode('utf-8'))
+        return json.loads(data[1:].decode('utf-8'))
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        try:
+            values = self.client.mget(keys)
+        except Exception as e:
+            logging.warning('[CACHE]: redis get failed: {}'.format(e))
+            return {}
+
+        return dict((key, RedisBackend.loads(value)) for key, value in zip(keys, values) if value is not None)
+
+    def set(self, key, value, ttl):
+        self.set_many({key: value}, ttl)
+
+    def set_many(self, mapping, ttl):
+        try:
+            pipeline = self.client.pipeline(transaction=False)
+            for key, value in mapping.items():
+                pipeline.set(key, RedisBackend.dumps(value), ex=int(ttl))
+            pipeline.execute()
+        except Exception as e:
+            logging.warning('[CACHE]: redis set failed: {}'.format(e))
+
+    def clear(self):
+        """delete the keys under the prefix, the database may be shared with other services"""
+        try:
+            keys = []
+            for key in self.client.scan_iter(match=self.prefix + '*', count=1000):
+                keys.append(key)
+                if len(keys) == 1000:
+                    self.client.delete(*keys)
+                    keys = []
+            if keys:
+                self.client.delete(*keys)
+        except Exception as e:
+            logging.warning('[CACHE]: redis clear failed: {}'.format(e))
+
+
+_backend = None
+_backend_pid = None
+_lock = threading.Lock()
+
+
+def get_backend():
+    """backend configured by cache.backend, created once per (forked) worker process"""
+    global _backend, _backend_pid
+
+    with _lock:
+        if _backend is None or _backend_pid != os.getpid():
+            config = settings.get('cache', {})
+
+            if config.get('backend') == 'redis':
+                _backend = RedisBackend(config.get('redis_url'), config.get('prefix', ''))
+            else:
+                _backend = MemoryBackend(config.get('max_entries', 4096), config.get('max_bytes'),
+                                         config.get('max_entry_bytes'))
+
+            _backend_pid = os.getpid()
+
+        return _backend
+
+
+def reset_backend():
+    global _backend
+
+    with _lock:
+        _backend = None
+
+
+class Cache(object):
+    """Namespaced view of the backend with a ttl taken from the cache settings
+    With keep_stale, values are also kept for cache.stale_ttl as last known good results
+    served while their upstream is unavailable."""
+
+    def __init__(self, namespace, ttl_setting, keep_stale=False):
+        self.namespace = namespace
+        self.ttl_setting = ttl_setting
+        self.keep_stale = keep_stale
+
+    def _key(self, key, stale=False):
+        digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+        namespace = self.namespace + '-stale' if stale else self.namespace
+        return '{}{}:{}'.format(settings.get('cache', {}).get('prefix', ''), namespace, digest)
+
+    def get(self, key):
+        value = get_backend().get(self._key(key))
+        metrics.incr('cache.{}.{}'.format(self.namespace, 'misses' if value is None else 'hits'))
+        return value
+
+    def get_many(self, keys):
+        """values found for the (hashable) keys, in a single backend round trip"""
+        hashed = dict((self._key(key), key) for key in keys)
+        found = get_backend().get_many(list(hashed))
+
+        metrics.incr('cache.{}.hits'.format(self.namespace), len(found))
+        metrics.incr('cache.{}.misses'.format(self.namespace), len(hashed) - len(found))
+
+        return dict((hashed[hashed_key], value) for hashed_key, value in found.items())
+
+    def ttl(self):
+        return settings.get('cache', {}).get(self.ttl_setting, 300)
+
+    def get_stale(self, key):
+        """last known good value, even if it expired"""
+        return get_backend().get(self._key(key, stale=True)) if self.keep_stale else None
+
+    def set(self, key, value):
+        self._store([(key, value)])
+
+    def set_many(self, mapping):
+        self._store(mapping.items())
+
+    def _store(self, items):
+        items = list(items)
+        get_backend().set_many(dict((self._key(key), value) for key, value in items), self.ttl())
+
+        if self.keep_stale:
+            get_backend().set_many(dict((self._key(key, stale=True), value) for key, value in items),
+                                   settings.get('cache', {}).get('stale_ttl', 604800))
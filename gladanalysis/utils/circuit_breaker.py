@@ -0,0 +1,130 @@
+"""Per-upstream circuit breakers
+
+The outcome of recent calls to each upstream is kept in a sliding window. When the
+share of failed or slow calls gets over its threshold the circuit opens: calls fail at
+once with UpstreamUnavailable for circuit_breaker.open_seconds, then a single probe
+call is let through to decide whether to close it again. Services answer open circuits
+with the last known good result when they have one, and the response is marked stale."""
+
+import logging
+import threading
+import time
+from collections import deque
+
+from flask import g, has_app_context
+
+from gladanalysis.config import settings
+from gladanalysis.errors import UpstreamUnavailable
+from gladanalysis.utils import metrics
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+
+def _settings():
+    return settings.get('circuit_breaker', {})
+
+
+class CircuitBreaker(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.state = CLOSED
+        self.opened_at = None
+        self._outcomes = deque(maxlen=_settings().get('window', 50))
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """raise UpstreamUnavailable unless a call may be sent"""
+        config = _settings()
+
+        with self._lock:
+            if self.state == CLOSED or not config.get('enabled'):
+                return
+
+            if self.state == OPEN and time.time() - self.opened_at >= config.get('open_seconds', 30):
+                # let a single probe through
+                self.state = HALF_OPEN
+                return
+
+        metrics.incr('circuit.{}.rejected'.format(self.name))
+        raise UpstreamUnavailable(message='{} service unavailable'.format(self.name.capitalize()))
+
+    def record(self, failed, duration):
+        config = _settings()
+        slow = duration >= config.get('slow_call', 10)
+
+        with self._lock:
+            if self.state == HALF_OPEN:
+                if failed or slow:
+                    self._open()
+                else:
+                    logging.info('[CIRCUIT]: {} closed'.format(self.name))
+                    self.state = CLOSED
+                    self._outcomes.clear()
+                return
+
+            self._outcomes.append((failed, slow))
+            calls = len(self._outcomes)
+            if self.state != CLOSED or calls < config.get('min_calls', 20):
+                return
+
+            failures = sum(1 for outcome in self._outcomes if outcome[0])
+            slow_calls = sum(1 for outcome in self._outcomes if outcome[1])
+
+            if float(failures) / calls >= config.get('error_rate', 0.5) or \
+                    float(slow_calls) / calls >= config.get('slow_rate', 0.5):
+                self._open()
+
+    def release(self):
+        """give the call up without an outcome (e.g. the caller's deadline was spent)
+        a half-open circuit opens again with its timer already elapsed, so the next call probes it"""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.state = OPEN
+
+    def _open(self):
+        logging.warning('[CIRCUIT]: {} opened'.format(self.name))
+        metrics.incr('circuit.{}.opened'.format(self.name))
+        self.state = OPEN
+        self.opened_at = time.time()
+        self._outcomes.clear()
+
+
+_breakers = {}
+_lock = threading.Lock()
+
+
+def get_breaker(name):
+    with _lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+
+        return _breakers[name]
+
+
+def reset():
+    with _lock:
+        _breakers.clear()
+
+
+def start_request():
+    """before_request hook"""
+    g.stale = set()
+
+
+def mark_stale(name):
+    """flag the current response as (partly) built from results kept while the upstream was healthy"""
+    metrics.incr('circuit.{}.stale'.format(name))
+
+    stale = getattr(g, 'stale', None) if has_app_context() else None
+    if stale is not None:
+        stale.add(name)
+
+
+def stale_response(response):
+    """after_request hook, stale responses get a Warning header and must not be cached by clients"""
+    if getattr(g, 'stale', None):
+        response.headers['Warning'] = '110 - "Response is Stale"'
+        response.headers['Cache-Control'] = 'no-cache'
+
+    return response
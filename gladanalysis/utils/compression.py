@@ -0,0 +1,76 @@
+"""Accept-Encoding negotiated compression of large JSON responses"""
+
+import resource
+import time
+import zlib
+
+from flask import request
+
+from gladanalysis.config import settings
+from gladanalysis.utils import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def _cpu_time():
+    """cpu seconds of the current thread, of the process where the interpreter can't tell (python 2)
+    unlike wall-clock time it leaves out greenlets running while the response is compressed"""
+    if hasattr(time, 'thread_time'):
+        return time.thread_time()
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _gzip(data, level):
+    # wbits 16 + MAX_WBITS writes a gzip container
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def choose_encoding(accept_encodings):
+    if brotli is not None and accept_encodings.quality('br') > 0:
+        return 'br'
+
+    if accept_encodings.quality('gzip') > 0:
+        return 'gzip'
+
+    return None
+
+
+def compress_response(response):
+    """after_request hook compressing JSON bodies above compression.min_size bytes"""
+
+    config = settings.get('compression', {})
+
+    if not config.get('enabled') or response.status_code != 200 or response.direct_passthrough:
+        return response
+
+    if response.mimetype != 'application/json' or 'Content-Encoding' in response.headers:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    encoding = choose_encoding(request.accept_encodings)
+
+    if encoding is None or len(data) < config.get('min_size', 1024):
+        return response
+
+    start = _cpu_time()
+    if encoding == 'br':
+        compressed = brotli.compress(data, quality=config.get('brotli_quality', 4))
+    else:
+        compressed = _gzip(data, config.get('gzip_level', 6))
+
+    metrics.observe('compression.{}.cpu_seconds'.format(encoding), _cpu_time() - start)
+    metrics.incr('compression.{}.responses'.format(encoding))
+    metrics.incr('compression.bytes_in', len(data))
+    metrics.incr('compression.bytes_saved', len(data) - len(compressed))
+
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+
+    return response
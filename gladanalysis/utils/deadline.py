@@ -0,0 +1,55 @@
+"""Per-request deadline budget
+
+A deadline is set when a request starts (per route, overridable with the
+x-request-deadline header) and every upstream call gets the remaining budget as
+its timeout, so a slow dependency fails the request with a 504 before gunicorn
+kills the worker."""
+
+import time
+
+from flask import g, has_app_context, request
+
+from gladanalysis.config import settings
+from gladanalysis.errors import DeadlineExceeded
+
+
+def start_request():
+    """before_request hook setting the deadline of the current request"""
+    config = settings.get('deadline', {})
+    seconds = config.get('routes', {}).get(request.endpoint, config.get('default'))
+
+    header = request.headers.get('x-request-deadline')
+    if header:
+        try:
+            requested = float(header)
+        except ValueError:
+            requested = None
+
+        # clients can shorten the budget, not opt out of it (0, negative, nan or inf keep the route default)
+        if requested is not None and 0 < requested < float('inf'):
+            # a budget shorter than the route's is the client's choice, running out of it says nothing of upstreams
+            g.client_deadline = seconds is None or requested < seconds
+            seconds = min(requested, config.get('max'))
+
+    if seconds:
+        g.deadline = time.time() + seconds
+
+
+def client_shortened():
+    """whether the current request runs with a shorter deadline than its route's, asked by the client"""
+    return bool(getattr(g, 'client_deadline', False)) if has_app_context() else False
+
+
+def remaining(cap=None):
+    """seconds left for the current request, at most cap; None when no deadline applies
+    raises DeadlineExceeded once the budget is spent"""
+    deadline = getattr(g, 'deadline', None) if has_app_context() else None
+
+    if deadline is None:
+        return cap
+
+    left = deadline - time.time()
+    if left <= 0:
+        raise DeadlineExceeded(message='Request deadline exceeded')
+
+    return min(left, cap) if cap else left
@@ -0,0 +1,80 @@
+"""Bounded concurrent fan-out
+
+Runs a function over several items from a few threads (greenlets under the gevent
+workers) that see the current request and its deadline, so services relying on
+flask.request and upstream calls can be used as is."""
+
+import threading
+
+from flask import current_app, g, has_request_context, request
+from flask.globals import _request_ctx_stack
+
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+
+
+def map_concurrently(func, items, max_workers):
+    """[func(item) for item in items] computed by at most max_workers threads
+    the first exception raised by func is raised once every thread stopped"""
+
+    items = list(items)
+    if not items:
+        return []
+
+    app = current_app._get_current_object()
+    # the deadline, slow request trace and stale flags are shared with the threads
+    shared = dict((name, getattr(g, name)) for name in ('deadline', 'trace', 'stale')
+                  if getattr(g, name, None) is not None)
+
+    if has_request_context():
+        # the request object is shared by the threads, parse what they read before starting them
+        request.args
+        request.get_json(silent=True)
+
+    work = Queue()
+    for index, item in enumerate(items):
+        work.put((index, item))
+
+    results = [None] * len(items)
+    errors = []
+
+    def worker(request_context):
+        # fresh app context so nothing else of g (admission slot, profiler) is released by the thread's teardown
+        with app.app_context():
+            for name, value in shared.items():
+                setattr(g, name, value)
+            if request_context is not None:
+                request_context.push()
+
+            try:
+                while not errors:
+                    try:
+                        index, item = work.get_nowait()
+                    except Empty:
+                        return
+
+                    try:
+                        results[index] = func(item)
+                    except Exception as e:
+                        errors.append(e)
+            finally:
+                if request_context is not None:
+                    request_context.pop()
+
+    threads = []
+    for _ in range(min(max_workers, len(items))):
+        request_context = _request_ctx_stack.top.copy() if has_request_context() else None
+        thread = threading.Thread(target=worker, args=(request_context,))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+
+    return results
@@ -0,0 +1,131 @@
+"""Bounded process pool for CPU-bound geometry work
+
+Gunicorn runs this service with gevent workers, so shapely/pyproj work executed
+inline blocks every greenlet sharing the worker. Heavy geometries are shipped to
+a small set of long-lived child processes instead; the parent waits on the result
+pipe with select, which gevent makes cooperative, and pickles and writes tasks (reads
+and unpickles results) from the threadpool of the gevent hub."""
+
+import logging
+import multiprocessing
+import os
+import select
+import threading
+
+from gladanalysis.config import settings
+from gladanalysis.errors import GeometryTimeout
+from gladanalysis.utils import deadline
+
+try:
+    from gevent import get_hub
+    from gevent.monkey import is_module_patched
+except ImportError:
+    get_hub = None
+
+
+def _worker_loop(conn):
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+
+        if task is None:
+            break
+
+        func, args = task
+        try:
+            conn.send(('ok', func(*args)))
+        except Exception as e:
+            conn.send(('error', e))
+
+
+def _cooperative(func, *args):
+    """func(*args), from the hub threadpool when gevent is patched in so large geometries don't block the loop"""
+    if get_hub is not None and is_module_patched('select'):
+        return get_hub().threadpool.apply(func, args)
+
+    return func(*args)
+
+
+class _Worker(object):
+
+    def __init__(self):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_worker_loop, args=(child_conn,))
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()
+
+    def stop(self):
+        try:
+            self.process.terminate()
+            self.conn.close()
+        except Exception:
+            pass
+
+
+class GeometryPool(object):
+    """Per-process pool of geometry workers, created lazily after gunicorn forks"""
+
+    _lock = threading.Lock()
+    _pid = None
+    _idle = []
+    _slots = None
+
+    @staticmethod
+    def size():
+        return settings.get('geometry', {}).get('pool_size', 0)
+
+    @staticmethod
+    def _ensure_started():
+        with GeometryPool._lock:
+            if GeometryPool._pid == os.getpid():
+                return
+
+            GeometryPool._pid = os.getpid()
+            GeometryPool._idle = [_Worker() for _ in range(GeometryPool.size())]
+            GeometryPool._slots = threading.BoundedSemaphore(GeometryPool.size())
+            logging.info('[GEOMETRY POOL]: started {} workers'.format(GeometryPool.size()))
+
+    @staticmethod
+    def run(func, *args):
+        """Execute func(*args) in a pool process; func must be a picklable module level function"""
+
+        if GeometryPool.size() <= 0:
+            return func(*args)
+
+        GeometryPool._ensure_started()
+        timeout = deadline.remaining(settings.get('geometry', {}).get('timeout'))
+
+        with GeometryPool._slots:
+            with GeometryPool._lock:
+                worker = GeometryPool._idle.pop()
+
+            try:
+                _cooperative(worker.conn.send, (func, args))
+                ready = select.select([worker.conn], [], [], timeout)[0]
+
+                if not ready:
+                    # the task is still running: kill it instead of leaving a busy process behind
+                    worker.stop()
+                    worker = _Worker()
+                    raise GeometryTimeout(message='Geometry computation timed out')
+
+                status, result = _cooperative(worker.conn.recv)
+
+            except GeometryTimeout:
+                raise
+            except Exception:
+                worker.stop()
+                worker = _Worker()
+                raise
+
+            finally:
+                with GeometryPool._lock:
+                    GeometryPool._idle.append(worker)
+
+        if status == 'error':
+            raise result
+
+        return result
@@ -0,0 +1,153 @@
+"""Asynchronous analysis jobs
+
+A request sent with async=true is stored as a job and answered at once with its id.
+A few background threads (greenlets under gevent) per worker replay queued jobs
+against their view function with the jobs.timeout deadline instead of the request
+one, and store the state and result of every job in the cache for cache.job_ttl, so
+with the redis backend any worker can answer polls. Jobs left queued or running for
+longer than jobs.timeout (their worker was recycled or killed) are reported failed."""
+
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from flask import current_app, g, request
+
+from gladanalysis.config import settings
+from gladanalysis.errors import ServiceOverloaded
+from gladanalysis.utils import circuit_breaker, metrics
+from gladanalysis.utils.cache import Cache
+
+try:
+    from queue import Queue, Full
+except ImportError:
+    from Queue import Queue, Full
+
+_jobs = Cache('jobs', 'job_ttl')
+
+_queue = None
+_queue_pid = None
+_lock = threading.Lock()
+
+
+def _worker(queue):
+    while True:
+        app, job_id, job = queue.get()
+        try:
+            run(app, job_id, job)
+        except Exception:
+            logging.exception('[JOBS]: job {} failed'.format(job_id))
+
+
+def _get_queue():
+    """job queue of this (forked) worker process, started on first use"""
+    global _queue, _queue_pid
+
+    with _lock:
+        if _queue is None or _queue_pid != os.getpid():
+            config = settings.get('jobs', {})
+            _queue = Queue(maxsize=config.get('queue_size', 20))
+            _queue_pid = os.getpid()
+
+            for _ in range(config.get('workers', 2)):
+                thread = threading.Thread(target=_worker, args=(_queue,))
+                thread.daemon = True
+                thread.start()
+
+        return _queue
+
+
+def submit():
+    """queue the current request as a job and return its id, raises ServiceOverloaded when the queue is full"""
+
+    job = {
+        'endpoint': request.endpoint,
+        'view_args': request.view_args,
+        'method': request.method,
+        'path': request.path,
+        'query_string': [(key, value) for key, value in request.args.items(multi=True) if key != 'async'],
+        'body': request.get_data(),
+        'content_type': request.content_type,
+        'accept': request.headers.get('Accept')
+    }
+    job_id = uuid.uuid4().hex
+
+    _jobs.set(job_id, {'status': 'queued', 'submitted': time.time()})
+    try:
+        _get_queue().put_nowait((current_app._get_current_object(), job_id, job))
+    except Full:
+        metrics.incr('jobs.rejected')
+        _jobs.set(job_id, {'status': 'failed', 'code': 503, 'detail': 'Too many queued jobs'})
+        raise ServiceOverloaded(message='Too many queued jobs, retry later')
+
+    metrics.incr('jobs.submitted')
+    return job_id
+
+
+def _timeout():
+    return settings.get('jobs', {}).get('timeout', 600)
+
+
+def run(app, job_id, job):
+    """replay a job against its view function and store its outcome"""
+
+    started = time.time()
+    state = _jobs.get(job_id) or {}
+    if started - state.get('submitted', started) > _timeout():
+        # already reported failed to polls, see get
+        _jobs.set(job_id, dict(state, **_expired(state)))
+        return
+
+    _jobs.set(job_id, dict(state, status='running', started=started))
+
+    headers = {'Accept': job['accept']} if job['accept'] else {}
+    with app.test_request_context(job['path'], method=job['method'], query_string=job['query_string'],
+                                  data=job['body'], content_type=job['content_type'], headers=headers):
+        # the setup of the before_request hooks a request would have run
+        circuit_breaker.start_request()
+        g.deadline = started + _timeout()
+
+        try:
+            try:
+                response = app.view_functions[job['endpoint']](**job['view_args'])
+            except Exception as e:
+                # registered error handlers (deadline, unavailable upstream...) answer as for a request
+                response = app.handle_user_exception(e)
+
+            response = app.make_response(response)
+            outcome = {'status': 'done' if response.status_code == 200 else 'failed', 'code': response.status_code,
+                       'result': json.loads(response.get_data().decode('utf-8'))}
+            if g.stale:
+                # built from results kept while the upstreams were healthy, as the Warning header of requests
+                outcome['stale'] = True
+        except Exception as e:
+            logging.exception('[JOBS]: job {} failed'.format(job_id))
+            outcome = {'status': 'failed', 'code': 500, 'detail': getattr(e, 'message', None) or str(e)}
+
+    duration = time.time() - started
+    metrics.observe('jobs.duration', duration)
+    _jobs.set(job_id, dict(state, finished=time.time(), duration=duration, **outcome))
+
+
+def _expired(state):
+    """failed state of a job queued or running for longer than jobs.timeout, None otherwise"""
+    if state.get('status') == 'queued' and time.time() - state.get('submitted', 0) > _timeout():
+        return {'status': 'failed', 'code': 504, 'detail': 'Job was not started in time'}
+
+    if state.get('status') == 'running' and time.time() - state.get('started', 0) > _timeout():
+        return {'status': 'failed', 'code': 504, 'detail': 'Job was interrupted'}
+
+    return None
+
+
+def get(job_id):
+    """state of the job, None if it is unknown or expired"""
+    state = _jobs.get(job_id)
+    if state is None:
+        return None
+
+    expired = _expired(state)
+    return dict(state, **expired) if expired else state
@@ -0,0 +1,141 @@
+"""Opt-in per-worker memory tracking
+
+With memory.enabled the resident set size of the worker is read around every request
+and kept per route (largest size after a request, total and largest growth). Allocations
+are traced by source line with tracemalloc when the interpreter has it, otherwise live
+objects are counted by type through gc. The admin memory endpoint compares them with
+the first snapshot taken by the worker, so what keeps growing between requests is
+listed first. Under gevent requests overlap, the growth of a route also holds what
+requests served at the same time allocated."""
+
+import gc
+import os
+import resource
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import g, request
+
+from gladanalysis.config import settings
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+_lock = threading.Lock()
+_routes = {}
+_baseline = None
+_pid = None
+
+
+def _settings():
+    return settings.get('memory', {})
+
+
+def rss():
+    """resident set size of this process in bytes"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except IOError:
+        # without /proc fall back to the peak size
+        return peak_rss()
+
+
+def peak_rss():
+    """largest resident set size of this process in bytes (ru_maxrss is in kilobytes on linux)"""
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def _allocations():
+    if tracemalloc is not None:
+        # leave out what the snapshots themselves allocate
+        return tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+
+    return Counter(type(obj).__name__ for obj in gc.get_objects())
+
+
+def _start():
+    """take the baseline of this (forked) worker process on first use"""
+    global _baseline, _pid
+
+    with _lock:
+        if _pid == os.getpid():
+            return
+
+        if tracemalloc is not None and not tracemalloc.is_tracing():
+            tracemalloc.start(_settings().get('frames', 1))
+
+        _routes.clear()
+        _pid = os.getpid()
+        _baseline = {'time': time.time(), 'rss': rss(), 'allocations': _allocations()}
+
+
+def start_request():
+    """before_request hook"""
+    if not _settings().get('enabled'):
+        return
+
+    _start()
+    g.memory_start = rss()
+
+
+def finish_request(response):
+    """after_request hook keeping the memory used by every route"""
+    start = getattr(g, 'memory_start', None)
+    if start is None:
+        return response
+
+    end = rss()
+    route = request.url_rule.rule if request.url_rule else request.path
+
+    with _lock:
+        stats = _routes.setdefault(route, {'requests': 0, 'peakRss': 0, 'growth': 0, 'maxGrowth': 0})
+        stats['requests'] += 1
+        stats['peakRss'] = max(stats['peakRss'], end)
+        stats['growth'] += end - start
+        stats['maxGrowth'] = max(stats['maxGrowth'], end - start)
+
+    return response
+
+
+def report(limit=20):
+    """memory of this worker process, with the limit allocation sites (or object types) that grew most
+    only the size of the process while tracking is disabled, so reports don't start tracing"""
+    if not _settings().get('enabled'):
+        return {'enabled': False, 'pid': os.getpid(), 'rss': rss(), 'peakRss': peak_rss()}
+
+    _start()
+    allocations = _allocations()
+
+    with _lock:
+        routes = dict((route, dict(stats)) for route, stats in _routes.items())
+
+    data = {
+        'enabled': True,
+        'pid': _pid,
+        'rss': rss(),
+        'peakRss': peak_rss(),
+        'baselineRss': _baseline['rss'],
+        'uptime': time.time() - _baseline['time'],
+        'routes': routes
+    }
+
+    if tracemalloc is not None:
+        data['tracer'] = 'tracemalloc'
+        data['allocations'] = [{'location': '{}:{}'.format(stat.traceback[0].filename, stat.traceback[0].lineno),
+                                'size': stat.size, 'sizeDiff': stat.size_diff,
+                                'count': stat.count, 'countDiff': stat.count_diff}
+                               for stat in allocations.compare_to(_baseline['allocations'], 'lineno')[:limit]]
+    else:
+        data['tracer'] = 'gc'
+        baseline = _baseline['allocations']
+        growth = sorted(allocations, key=lambda name: allocations[name] - baseline.get(name, 0), reverse=True)
+        data['objects'] = [{'type': name, 'count': allocations[name],
+                            'countDiff': allocations[name] - baseline.get(name, 0)} for name in growth[:limit]]
+
+    return data
@@ -0,0 +1,41 @@
+"""In-process metrics registry
+
+Counters and timing summaries are kept per worker process and exposed through the
+admin metrics endpoint."""
+
+import threading
+
+_lock = threading.Lock()
+_counters = {}
+_timings = {}
+
+
+def incr(name, value=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def observe(name, value):
+    """record one observation (e.g. a duration in seconds) under name"""
+    with _lock:
+        timing = _timings.setdefault(name, {'count': 0, 'sum': 0.0, 'max': 0.0})
+        timing['count'] += 1
+        timing['sum'] += value
+        timing['max'] = max(timing['max'], value)
+
+
+def snapshot():
+    with _lock:
+        counters = dict(_counters)
+        timings = dict((name, dict(timing)) for name, timing in _timings.items())
+
+    for timing in timings.values():
+        timing['mean'] = timing['sum'] / timing['count'] if timing['count'] else 0.0
+
+    return {'counters': counters, 'timings': timings}
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _timings.clear()
@@ -0,0 +1,123 @@
+"""Opt-in per-request profiling
+
+A request is profiled when it carries the x-profile header together with a valid
+admin token, or when it is picked by profiling.sample_rate. Profiles are kept in a
+bounded per-worker ring buffer and downloaded through the admin endpoints.
+Under gevent the profiler follows the worker thread, so time spent in greenlets
+switched to while the request waits on IO is included. Concurrent requests share that
+thread and a profiler hook, so a single request is profiled at a time per worker:
+requests asking for a profile while another one is running are served unprofiled."""
+
+import cProfile
+import marshal
+import pstats
+import random
+import threading
+import time
+import uuid
+from collections import deque
+
+from flask import g, request
+
+from gladanalysis.config import settings
+from gladanalysis.utils import metrics
+from gladanalysis.validators import has_admin_token
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+_lock = threading.Lock()
+# held by the request being profiled
+_active = threading.Lock()
+_profiles = deque(maxlen=settings.get('profiling', {}).get('buffer_size', 20))
+
+
+class _LoadedProfile(object):
+    """minimal profile-like object so pstats can load marshalled stats from memory"""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def _requested():
+    if request.headers.get('x-profile', '').lower() == 'true' and has_admin_token():
+        return True
+
+    sample_rate = settings.get('profiling', {}).get('sample_rate', 0)
+    return sample_rate > 0 and random.random() < sample_rate
+
+
+def start_profile():
+    """before_request hook"""
+    if _requested():
+        if not _active.acquire(False):
+            metrics.incr('profiles.skipped')
+            return
+
+        g.profile_start = time.time()
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+
+def stop_profile(response):
+    """after_request hook storing the profile of the request"""
+    profiler = getattr(g, 'profiler', None)
+
+    if profiler is None:
+        return response
+
+    profiler.disable()
+    g.profiler = None
+    _active.release()
+    profiler.create_stats()
+
+    profile = {
+        'id': uuid.uuid4().hex,
+        'time': g.profile_start,
+        'method': request.method,
+        'path': request.full_path,
+        'status': response.status_code,
+        'duration': time.time() - g.profile_start,
+        'stats': marshal.dumps(profiler.stats)
+    }
+    with _lock:
+        _profiles.append(profile)
+
+    response.headers['X-Profile-Id'] = profile['id']
+    return response
+
+
+def discard_profile(exception=None):
+    """teardown_request hook, makes sure a failed request doesn't leave the profiler running"""
+    profiler = getattr(g, 'profiler', None)
+
+    if profiler is not None:
+        profiler.disable()
+        g.profiler = None
+        _active.release()
+
+
+def list_profiles():
+    with _lock:
+        return [dict((key, value) for key, value in profile.items() if key != 'stats') for profile in _profiles]
+
+
+def get_profile(profile_id):
+    with _lock:
+        for profile in _profiles:
+            if profile['id'] == profile_id:
+                return profile
+    return None
+
+
+def format_profile(profile, limit=50):
+    """text report of the functions with the highest cumulative time"""
+    stream = StringIO()
+    stats = pstats.Stats(_LoadedProfile(marshal.loads(profile['stats'])), stream=stream)
+    stats.sort_stats('cumulative').print_stats(limit)
+    return stream.getvalue()
@@ -0,0 +1,85 @@
+"""Slow request capture
+
+Every request keeps a small trace (queries sent, geometry size, upstream call
+durations). Requests slower than slow_requests.threshold are stored with their trace
+in a bounded per-worker ring buffer, listed through the admin endpoints, to show
+which period/geometry/aggregation shapes are slow."""
+
+import threading
+import time
+from collections import deque
+
+from flask import g, has_app_context, request
+
+from gladanalysis.config import settings
+from gladanalysis.utils import metrics
+
+_lock = threading.Lock()
+_requests = deque(maxlen=settings.get('slow_requests', {}).get('buffer_size', 50))
+
+
+def _trace():
+    return getattr(g, 'trace', None) if has_app_context() else None
+
+
+def start_request():
+    """before_request hook"""
+    g.trace = {'start': time.time(), 'sql': [], 'upstream': [], 'vertices': None}
+
+
+def record_sql(sql):
+    trace = _trace()
+    if trace is not None:
+        trace['sql'].append(sql)
+
+
+def record_upstream(name, duration, status):
+    trace = _trace()
+    if trace is not None:
+        trace['upstream'].append({'name': name, 'duration': duration, 'status': status})
+
+
+def record_vertices(count):
+    trace = _trace()
+    if trace is not None:
+        trace['vertices'] = (trace['vertices'] or 0) + count
+
+
+def finish_request(response):
+    """after_request hook keeping the trace of slow requests"""
+    trace = _trace()
+    if trace is None:
+        return response
+
+    duration = time.time() - trace['start']
+    if duration < settings.get('slow_requests', {}).get('threshold', 5):
+        return response
+
+    metrics.incr('slow_requests')
+    slow_request = {
+        'time': trace['start'],
+        'method': request.method,
+        'route': request.url_rule.rule if request.url_rule else request.path,
+        'path': request.path,
+        'args': dict((key, value) for key, value in request.args.items() if key != 'loggedUser'),
+        'status': response.status_code,
+        'duration': duration,
+        'sql': list(trace['sql']),
+        'vertices': trace['vertices'],
+        'upstream': list(trace['upstream'])
+    }
+    with _lock:
+        _requests.append(slow_request)
+
+    return response
+
+
+def list_requests():
+    """slow requests kept by this worker, most recent first"""
+    with _lock:
+        return list(reversed(_requests))
+
+
+def clear():
+    with _lock:
+        _requests.clear()
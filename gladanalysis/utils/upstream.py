@@ -0,0 +1,205 @@
+"""Upstream call layer
+
+Every request to another microservice (query, geostore) goes through request_upstream
+so latency is tracked per upstream and read-only calls can be hedged: when a call takes
+longer than the configured percentile of recent latencies, a duplicate is sent and
+whichever answers first is used. Calls are sent with the remaining request
+deadline as timeout, through the circuit breaker of their upstream."""
+
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+import RWAPIMicroservicePython
+import requests
+from RWAPIMicroservicePython.errors import NotFound
+
+from gladanalysis.config import settings
+from gladanalysis.errors import DeadlineExceeded
+from gladanalysis.utils import circuit_breaker, deadline, metrics, slow_requests
+
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+
+_lock = threading.Lock()
+_latencies = {}
+_hedged = {}
+
+
+def _hedging_settings():
+    return settings.get('hedging', {})
+
+
+def _record(name, duration, hedged):
+    window = _hedging_settings().get('window', 200)
+
+    with _lock:
+        if duration is not None:
+            _latencies.setdefault(name, deque(maxlen=window)).append(duration)
+        _hedged.setdefault(name, deque(maxlen=window)).append(1 if hedged else 0)
+
+
+def hedge_delay(name):
+    """delay after which a duplicate is sent, None until enough latencies were observed"""
+    config = _hedging_settings()
+
+    with _lock:
+        latencies = sorted(_latencies.get(name, []))
+
+    if len(latencies) < config.get('min_samples', 20):
+        return None
+
+    index = min(len(latencies) - 1, int(len(latencies) * config.get('percentile', 95) / 100.0))
+    return max(config.get('min_delay', 0.05), latencies[index])
+
+
+def _hedge_allowed(name):
+    with _lock:
+        recent = _hedged.get(name, [])
+        hedges = sum(recent)
+        calls = len(recent)
+
+    return calls and float(hedges) / calls < _hedging_settings().get('max_rate', 0.1)
+
+
+def _server_error(response):
+    """whether a response carries an error of the upstream itself, rather than e.g. a not found"""
+    errors = response.get('errors') if isinstance(response, dict) else None
+    return bool(errors) and int(errors[0].get('status') or 500) >= 500
+
+
+def _failed(error, duration):
+    """whether an exception tells the upstream is unhealthy: connection errors, 5xx and timeouts, apart from
+    timeouts of requests whose client asked for a short deadline before the call got slow"""
+    if isinstance(error, DeadlineExceeded):
+        return duration >= settings.get('circuit_breaker', {}).get('slow_call', 10) or not deadline.client_shortened()
+
+    return isinstance(error, requests.exceptions.RequestException) or getattr(error, 'status', 0) >= 500
+
+
+def send(config, timeout=None):
+    """same request as RWAPIMicroservicePython.request_to_microservice, with a timeout"""
+    uri = config.get('uri')
+    if not config.get('ignore_version') and RWAPIMicroservicePython.API_VERSION:
+        uri = '/' + RWAPIMicroservicePython.API_VERSION + uri
+
+    headers = {
+        'content-type': 'application/json',
+        'Authorization': 'Bearer ' + RWAPIMicroservicePython.CT_TOKEN,
+        'APP_KEY': config.get('application', 'rw')
+    }
+    body = json.dumps(config.get('body')) if 'body' in config else None
+
+    try:
+        response = requests.request(config.get('method'), RWAPIMicroservicePython.CT_URL + uri, headers=headers,
+                                    data=body, timeout=timeout)
+    except requests.exceptions.Timeout:
+        raise DeadlineExceeded(message='Upstream request timed out')
+
+    try:
+        return response.json()
+    except ValueError:
+        error = NotFound(response.text)
+        error.status = response.status_code
+        raise error
+
+
+def _attempt(index, config, timeout, outcomes):
+    start = time.time()
+    try:
+        outcomes.put((index, 'ok', send(config, timeout), time.time() - start))
+    except Exception as e:
+        outcomes.put((index, 'error', e, time.time() - start))
+
+
+def _spawn(index, config, timeout, outcomes):
+    thread = threading.Thread(target=_attempt, args=(index, config, timeout, outcomes))
+    thread.daemon = True
+    thread.start()
+
+
+def request_upstream(name, config, hedge=False):
+    """send config to the microservice through control tower
+    :param name: upstream name used for latency tracking and metrics (e.g. query, geostore)
+    :param config: request_to_microservice config
+    :param hedge: whether the call is read-only and may be duplicated when slow"""
+
+    # a spent deadline fails before the breaker may let a probe through
+    timeout = deadline.remaining()
+    breaker = circuit_breaker.get_breaker(name)
+    breaker.allow()
+
+    metrics.incr('upstream.{}.calls'.format(name))
+    delay = hedge_delay(name) if hedge and _hedging_settings().get('enabled') else None
+
+    if delay is None:
+        start = time.time()
+        try:
+            response = send(config, timeout)
+        except Exception as e:
+            metrics.incr('upstream.{}.errors'.format(name))
+            slow_requests.record_upstream(name, time.time() - start, 'error')
+            if _failed(e, time.time() - start):
+                breaker.record(True, time.time() - start)
+            else:
+                breaker.release()
+            raise
+        duration = time.time() - start
+        breaker.record(_server_error(response), duration)
+
+        metrics.observe('upstream.{}.latency'.format(name), duration)
+        slow_requests.record_upstream(name, duration, 'ok')
+        _record(name, duration, False)
+        return response
+
+    start = time.time()
+    outcomes = Queue()
+    _spawn(0, config, timeout, outcomes)
+    launched = 1
+
+    try:
+        first = outcomes.get(timeout=delay)
+    except Empty:
+        first = None
+
+    if first is None and _hedge_allowed(name):
+        try:
+            hedge_timeout = deadline.remaining()
+        except DeadlineExceeded:
+            # nothing left for a duplicate, the first attempt times out as well
+            pass
+        else:
+            logging.debug('[UPSTREAM]: hedging {} call after {:.3f}s'.format(name, delay))
+            metrics.incr('upstream.{}.hedges'.format(name))
+            _spawn(1, config, hedge_timeout, outcomes)
+            launched = 2
+
+    # take the first successful answer, failing only when every attempt failed
+    pending = [first] if first else []
+    failure = None
+    for _ in range(launched):
+        index, status, value, duration = pending.pop() if pending else outcomes.get()
+
+        if status == 'ok':
+            metrics.observe('upstream.{}.latency'.format(name), duration)
+            slow_requests.record_upstream(name, time.time() - start, 'hedged' if launched > 1 else 'ok')
+            breaker.record(_server_error(value), time.time() - start)
+            _record(name, duration, launched > 1)
+            if index == 1:
+                metrics.incr('upstream.{}.hedges_won'.format(name))
+            return value
+
+        failure = value
+
+    metrics.incr('upstream.{}.errors'.format(name))
+    slow_requests.record_upstream(name, time.time() - start, 'error')
+    if _failed(failure, time.time() - start):
+        breaker.record(True, time.time() - start)
+    else:
+        breaker.release()
+    _record(name, None, launched > 1)
+    raise failure
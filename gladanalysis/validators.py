@@ -1,12 +1,15 @@
 """VALIDATORS"""
 
 import datetime
+import hmac
 import re
 from functools import wraps
 
 from flask import request
 
+from gladanalysis.config import settings
 from gladanalysis.routes.api.v2 import error
+from gladanalysis.services import DatasetService, SummaryService, TileService
 
 
 def validate_geostore(func):
@@ -34,12 +37,9 @@ def validate_agg(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
 
-        if request.method == 'GET':
-            agg_by = request.args.get('aggregate_by')
-            agg_values = request.args.get('aggregate_values')
-        elif request.method == 'POST':
-            agg_by = request.get_json().get('aggregate_by', None) if request.get_json() else None
-            agg_values = request.get_json().get('aggregate_values', None) if request.get_json() else None
+        # read from the query string for POST requests too, as analyze_area does
+        agg_by = request.args.get('aggregate_by')
+        agg_values = request.args.get('aggregate_values')
 
         if agg_values:
             if agg_values.lower() not in ['true', 'false']:
@@ -49,12 +49,23 @@ def validate_agg(func):
             agg_values = eval(agg_values.title())
 
         if agg_values and agg_by:
-            agg_list = ['day', 'week', 'quarter', 'month', 'year', 'julian_day']
+            agg_list = ['day', 'week', 'quarter', 'month', 'year', 'julian_day'] + SummaryService.STATISTICS
 
             if agg_by.lower() not in agg_list:
                 return error(status=400, detail="aggregate_by parameter not "
                                                 "in: {}".format(agg_list))
 
+            if agg_by.lower() in SummaryService.STATISTICS and request.args.get('since'):
+                return error(status=400, detail="{} statistics can't be used with since".format(agg_by))
+
+        window = request.args.get('window')
+        if window:
+            if not agg_values or not agg_by or agg_by.lower() != 'rolling':
+                return error(status=400, detail="window can only be used with aggregate_by=rolling")
+
+            if not window.isdigit() or not 0 < int(window) <= 366:
+                return error(status=400, detail="window must be a number of days between 1 and 366")
+
         if agg_by and not agg_values:
             return error(status=400, detail="aggregate_values parameter must be "
                                             "true in order to aggregate data")
@@ -64,6 +75,27 @@ def validate_agg(func):
     return wrapper
 
 
+def validate_format(func):
+    """validate output format arguments"""
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+
+        formats = ['json', 'columnar']
+        output_format = request.args.get('format')
+        delta_dates = request.args.get('delta_dates')
+
+        if output_format and output_format.lower() not in formats:
+            return error(status=400, detail="format parameter not in: {}".format(formats))
+
+        if delta_dates and delta_dates.lower() not in ['true', 'false']:
+            return error(status=400, detail="delta_dates parameter must be either true or false")
+
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
 def validate_terrai_period(func):
     """validate period argument"""
 
@@ -106,6 +138,138 @@ def validate_period(minYear):
                 return error(status=400, detail='Start date must be less than end date')
 
 
+def validate_since(func):
+    """validate since argument"""
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+
+        since = request.args.get('since', None)
+
+        if since:
+            if request.args.get('period'):
+                return error(status=400, detail="since and period can't be used together")
+
+            try:
+                since_date = datetime.datetime.strptime(since, '%Y-%m-%d')
+            except ValueError:
+                return error(status=400, detail="Incorrect since format, should be YYYY-MM-DD")
+
+            if since_date > datetime.datetime.now():
+                return error(status=400, detail="since can't be later than today")
+
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def validate_breakdown(func):
+    """validate breakdown argument"""
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+
+        breakdown = request.args.get('breakdown', None)
+
+        if breakdown:
+            if breakdown != 'features':
+                return error(status=400, detail="breakdown must be features")
+
+            geojson = request.get_json().get('geojson', None) if request.get_json() else None
+            if request.method != 'POST' or not geojson or geojson.get('type') != 'FeatureCollection':
+                return error(status=400, detail="breakdown requires a FeatureCollection geojson to be posted")
+
+            max_features = settings.get('fanout', {}).get('max_features')
+            if len(geojson.get('features', [])) > max_features:
+                return error(status=400, detail="breakdown is limited to {} features".format(max_features))
+
+            # values are keyed by feature id (or position), a repeated key would hide the other features
+            ids = [str(feature.get('id', index)) for index, feature in enumerate(geojson.get('features', []))]
+            duplicates = sorted(set(feature_id for feature_id in ids if ids.count(feature_id) > 1))
+            if duplicates:
+                return error(status=400, detail="breakdown needs unique feature ids, repeated: {}".format(
+                    ', '.join(duplicates)))
+
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def validate_mode(func):
+    """validate mode argument"""
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+
+        mode = request.args.get('mode', 'exact')
+
+        if mode not in ('exact', 'approximate'):
+            return error(status=400, detail="mode must be exact or approximate")
+
+        if mode == 'approximate':
+            if not TileService.available():
+                return error(status=400, detail="approximate mode isn't available")
+
+            if request.args.get('aggregate_values', '').lower() == 'true' or request.args.get('since'):
+                return error(status=400, detail="approximate mode only returns the number of alerts of a period")
+
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def validate_async(func):
+    """validate async argument"""
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+
+        if request.args.get('async', '').lower() == 'true':
+            # jobs are kept in the cache, polls only reach the worker that ran them when it's shared
+            if settings.get('cache', {}).get('backend') != 'redis':
+                return error(status=400, detail="async jobs need the redis cache backend")
+
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def validate_datasets(func):
+    """validate datasets argument"""
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+
+        datasets = request.args.get('datasets', None)
+
+        if datasets:
+            unknown = [name for name in datasets.split(',') if not DatasetService.get(name)]
+            if unknown:
+                return error(status=400, detail="Unknown datasets: {}, available datasets are {}".format(
+                    ', '.join(unknown), ', '.join(DatasetService.available())))
+
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def validate_limit(func):
+    """validate limit argument"""
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+
+        limit = request.args.get('limit', None)
+
+        if limit:
+            if not limit.isdigit() or not 0 < int(limit) <= 250:
+                return error(status=400, detail="limit must be a number between 1 and 250")
+
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
 def validate_use(func):
     """Use Validation"""
 
@@ -146,20 +310,10 @@ def validate_admin(func):
         elif len(iso_code) > 3 or len(iso_code) < 3:
             return error(status=400, detail="Must use a 3-letter ISO Code")
 
-        elif admin_id:
-            if re.search('[a-zA-Z]', admin_id):
+        for unit_id in (admin_id, dist_id):
+            if unit_id and not unit_id.isdigit():
                 return error(status=400, detail="For state and district queries please use numbers")
 
-            else:
-                pass
-
-        elif dist_id:
-            if re.search('[a-zA-Z]', dist_id):
-                return error(status=400, detail="For state and district queries please use numbers")
-
-            else:
-                pass
-
         return func(*args, **kwargs)
 
     return wrapper
@@ -182,3 +336,34 @@ def validate_wdpa(func):
         return func(*args, **kwargs)
 
     return wrapper
+
+
+def _bytes(value):
+    return value if isinstance(value, bytes) else value.encode('utf-8')
+
+
+def has_admin_token():
+    token = settings.get('admin', {}).get('token')
+    header = request.headers.get('x-admin-token')
+    if not token or header is None:
+        return False
+
+    # constant time, so the token can't be guessed from response times
+    return hmac.compare_digest(_bytes(header), _bytes(token))
+
+
+def validate_admin_token(func):
+    """validate the token of internal admin endpoints"""
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+
+        if not settings.get('admin', {}).get('token'):
+            return error(status=404, detail="Admin endpoints are disabled")
+
+        elif not has_admin_token():
+            return error(status=403, detail="Invalid admin token")
+
+        return func(*args, **kwargs)
+
+    return wrapper
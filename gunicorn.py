@@ -10,8 +10,9 @@ threads = 1
 worker_connections = 1000
 timeout = 60
 keepalive = 2
-max_requests = 1000
-max_requests_jitter = 50
+# workers are recycled after max_requests requests, 0 never recycles them
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 50))
 
 spew = False
 